@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # Headless unless told otherwise, must be set before pygame is imported
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1") # Keeps stdout clean for the JSON report
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pygame
+
+from world_object import Circle, BaseInteractiveObject, SimpleObjectConnection
+from engine import Engine
+from input_management import KEY_CODES
+from profiler import FrameProfiler
+from scene import Scene
+
+
+# Usage: python benchmark.py --sizes 1000 10000 100000 --frames 120 --output bench.json
+PHASES = ("events", "placement", "layout", "import", "depth_build", "respond", "input", "draw", "flip") # `Engine`'s profiler laps
+WINDOW_SIZE = (1080, 720)
+
+
+###################################################################
+# Synthetic scenes
+###################################################################
+
+
+def build_scene(screen:pygame.Surface, scene:Scene, n_nodes:int, edges_per_node:float, radius:int, rng:random.Random) -> List[Circle]:
+    # Nodes are spread uniformly over the window, each with its label, edges connect random pairs of nodes
+    width, height = screen.get_size()
+    nodes = []
+    for _ in range(n_nodes):
+        node = Circle(screen, rng.randrange(radius, width - radius), rng.randrange(radius, height - radius), radius=radius, depth=1)
+        scene.add(node)
+        nodes.append(node)
+
+    n_edges = min(int(n_nodes * edges_per_node), n_nodes * (n_nodes - 1) // 2)
+    connection_index = BaseInteractiveObject.connection_index
+    while len(connection_index) < n_edges:
+        node_a, node_b = rng.sample(nodes, 2)
+        if connection_index.between(node_a, node_b) is not None:
+            continue
+        edge = SimpleObjectConnection(screen, node_a, node_b)
+        node_a.add_bond("i_am_in_connection_with", edge, add_to_other_as_well=True)
+        node_b.add_bond("i_am_in_connection_with", edge, add_to_other_as_well=True)
+        scene.add(edge)
+    return nodes
+
+
+def clear_scene(scene:Scene) -> None:
+    for obj in list(scene):
+        if obj in scene:
+            scene.delete(obj)
+
+
+###################################################################
+# Scripted input
+###################################################################
+
+
+def key_event(event_type:int, key:str) -> pygame.event.Event:
+    return pygame.event.Event(event_type, key=KEY_CODES[key], mod=0)
+
+
+class InputScript:
+    # Repeats one interaction: hover a node, select it, drag it around, release it, then preview and place a new node.
+    # Returns (mouse position, mouse buttons, key events) for every frame
+    def __init__(self, nodes:List[Circle], rng:random.Random, drag_frames:int=30):
+        self.nodes = [node for node in nodes if node.bond_index.degree(node, "--")] or nodes # Dragging drags edges along
+        self.camera = BaseInteractiveObject.camera # Nodes are in world coordinates, the mouse is on screen
+        self.rng = rng
+        self.drag_frames = drag_frames
+        self.frames:List[Tuple[Tuple[int, int], Tuple[bool, bool, bool], List[pygame.event.Event]]] = []
+
+    def _plan(self) -> None:
+        width, height = WINDOW_SIZE
+        node = self.rng.choice(self.nodes)
+        x, y = self.camera.world_to_screen(node.x + node.radius*2//3, node.y) # Off center, the label sits in the middle
+        x, y = int(x), int(y)
+        released, left = (False, False, False), (True, False, False)
+        self.frames += [((x, y), released, []), ((x, y), left, [])] # Hover, then select
+        for i in range(1, self.drag_frames + 1):
+            t = i / self.drag_frames
+            self.frames.append(((int(x + (width//2 - x)*t), int(y + (height//2 - y)*t)), left, []))
+        self.frames += [((width//2, height//2), released, []), ((width//2, height//2), (False, False, True), []), ((width//2, height//2), released, [])]
+
+        # Placement preview follows the mouse until the left click, somewhere new every time so nodes don't pile up
+        px, py = self.rng.randrange(100, width - 150), self.rng.randrange(100, height - 100)
+        self.frames.append(((px, py), released, [key_event(pygame.KEYDOWN, "1")]))
+        self.frames.append(((px, py), released, [key_event(pygame.KEYUP, "1")]))
+        for i in range(1, 6):
+            self.frames.append(((px + 10*i, py), released, []))
+        self.frames += [((px + 50, py), left, []), ((px + 50, py), released, [])]
+
+    def next_frame(self):
+        if not self.frames:
+            self._plan()
+        return self.frames.pop(0)
+
+
+###################################################################
+# Reporting
+###################################################################
+
+
+def summarize(samples:List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples) * 1000
+    return {"mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)), "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+
+
+def summarize_counts(samples:List[int]) -> Dict[str, float]:
+    # Per-frame counts, e.g. geometry recomputed vs. reused
+    counts = np.asarray(samples)
+    return {"mean": float(counts.mean()), "p50": float(np.percentile(counts, 50)), "p90": float(np.percentile(counts, 90)),
+            "p99": float(np.percentile(counts, 99)), "max": float(counts.max())}
+
+
+def run_size(screen:pygame.Surface, n_nodes:int, args:argparse.Namespace) -> dict:
+    # One update and one render per scripted frame, timed by the engine's own profiler laps
+    rng = random.Random(args.seed)
+    profiler = FrameProfiler(window=args.frames, enabled=True)
+    engine = Engine(screen=screen, picking_mode=args.picking_mode, render_mode=args.render_mode, batch_edges=args.batch_edges,
+                    level_of_detail=args.level_of_detail, profiler=profiler, instrument_classes=args.instrument_classes)
+
+    build_start = time.perf_counter()
+    nodes = build_scene(screen, engine.scene, n_nodes, args.edges_per_node, args.radius, rng)
+    build_seconds = time.perf_counter() - build_start
+    n_objects, n_edges = len(engine.scene), len(BaseInteractiveObject.connection_index)
+    engine.camera.zoom_at(args.zoom, WINDOW_SIZE[0] / 2, WINDOW_SIZE[1] / 2)
+
+    script = InputScript(nodes, rng)
+    for _ in range(args.warmup + args.frames):
+        mouse_pos, mouse_pressed, key_events = script.next_frame()
+        for event in key_events:
+            pygame.event.post(event)
+        profiler.end_frame()
+        engine.process_events()
+        engine.update(mouse_pos, mouse_pressed)
+        engine.render()
+    profiler.end_frame()
+
+    # The profiler only keeps the last `frames` frames, which leaves the warmup out
+    timings = {name: list(totals) for name, totals in profiler.totals.items()}
+    totals = [sum(frame_times) for frame_times in zip(*(timings[phase] for phase in PHASES))]
+    result = {"nodes": n_nodes, "edges": n_edges, "objects": n_objects, "frames": args.frames, "build_seconds": build_seconds,
+              "phases": {phase: summarize(timings[phase]) for phase in PHASES},
+              "methods": {name: summarize(samples) for name, samples in timings.items() if name not in PHASES and name != "dump"},
+              "total": summarize(totals),
+              "counters": {name: summarize_counts(list(counts)) for name, counts in profiler.counters.items()}}
+    profiler.disable() # Unwraps the instrumented methods before the next engine wraps them again
+    clear_scene(engine.scene)
+    return result
+
+
+def main(argv:List[str]|None=None) -> dict:
+    parser = argparse.ArgumentParser(description="Headless frame loop benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Number of nodes per run")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--edges-per-node", type=float, default=2.0)
+    parser.add_argument("--radius", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--picking-mode", choices=["geometric", "depth_buffer"], default="geometric")
+    parser.add_argument("--render-mode", choices=["dirty_rects", "full"], default="dirty_rects")
+    parser.add_argument("--no-batch-edges", dest="batch_edges", action="store_false")
+    parser.add_argument("--no-lod", dest="level_of_detail", action="store_false")
+    parser.add_argument("--zoom", type=float, default=1.0, help="Camera zoom around the window center, below 1 exercises the reduced levels of detail")
+    parser.add_argument("--instrument-classes", action="store_true", help="Also time every respond/draw/draw_depth, slows the run down")
+    parser.add_argument("--output", default=None, help="JSON file to write, stdout if not given")
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+
+    # The objects print on every interaction, that's noise here
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [run_size(screen, n_nodes, args) for n_nodes in args.sizes]
+    pygame.quit()
+
+    report = {"python": platform.python_version(), "pygame": pygame.version.ver, "numpy": np.__version__,
+              "video_driver": os.environ.get("SDL_VIDEODRIVER"), "phases": list(PHASES),
+              "settings": {k: v for k, v in vars(args).items() if k != "output"}, "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main()
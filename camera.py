@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import math
+from typing import Tuple
+
+import pygame
+
+
+###################################################################
+# Camera
+###################################################################
+
+
+class Camera:
+    # World <-> screen transform. Objects keep their positions in world coordinates, the camera decides which part of the
+    # world the window shows and how large. `version` is bumped on every change, so cached screen-space state
+    # (dirty rects, the edge layer, the pick buffer) can tell when it has to start over
+    def __init__(self, size=(1080, 720), min_zoom:float=0.02, max_zoom:float=20.0):
+        self.width, self.height = size
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.x = 0.0 # World position of the window's top left corner
+        self.y = 0.0
+        self.zoom = 1.0 # Screen pixels per world unit
+        self.version = 0
+
+    def reset(self, size=None) -> None:
+        # Back to world = screen, e.g. for a new engine on the shared camera
+        if size is not None:
+            self.width, self.height = size
+        self.x = self.y = 0.0
+        self.zoom = 1.0
+        self.version += 1
+
+    #---------------------------------
+    # Transforms
+    #---------------------------------
+
+    def world_to_screen(self, x:float, y:float) -> Tuple[float, float]:
+        return (x - self.x) * self.zoom, (y - self.y) * self.zoom
+
+    def screen_to_world(self, x:float, y:float) -> Tuple[float, float]:
+        return x / self.zoom + self.x, y / self.zoom + self.y
+
+    def to_screen_rect(self, rect:pygame.Rect) -> pygame.Rect:
+        # Rounded outwards, so the result covers everything drawn inside `rect`
+        left, top = self.world_to_screen(rect.left, rect.top)
+        right, bottom = self.world_to_screen(rect.right, rect.bottom)
+        left, top = math.floor(left), math.floor(top)
+        return pygame.Rect(left, top, math.ceil(right) - left, math.ceil(bottom) - top)
+
+    def world_rect(self, margin:float=0) -> pygame.Rect:
+        # The part of the world in the window, grown by `margin` screen pixels on every side
+        left, top = self.screen_to_world(-margin, -margin)
+        right, bottom = self.screen_to_world(self.width + margin, self.height + margin)
+        left, top = math.floor(left), math.floor(top)
+        return pygame.Rect(left, top, math.ceil(right) - left, math.ceil(bottom) - top)
+
+    #---------------------------------
+    # Moving
+    #---------------------------------
+
+    def pan(self, dx:float, dy:float) -> None:
+        # By screen pixels, the picture moves along with (dx, dy)
+        if dx or dy:
+            self.x -= dx / self.zoom
+            self.y -= dy / self.zoom
+            self.version += 1
+
+    def grab(self, world_x:float, world_y:float, screen_x:float, screen_y:float) -> None:
+        # Pans so that the world point ends up under the screen point, e.g. the point grabbed when a drag started
+        x, y = self.screen_to_world(screen_x, screen_y)
+        if (x != world_x) or (y != world_y):
+            self.x += world_x - x
+            self.y += world_y - y
+            self.version += 1
+
+    def zoom_at(self, factor:float, screen_x:float, screen_y:float) -> None:
+        # Zooms around a screen point, e.g. the mouse, the world point under it stays put
+        zoom = min(self.max_zoom, max(self.min_zoom, self.zoom * factor))
+        if zoom == self.zoom:
+            return
+        world_x, world_y = self.screen_to_world(screen_x, screen_y)
+        self.zoom = zoom
+        self.grab(world_x, world_y, screen_x, screen_y)
+        self.version += 1
+
+    def fit(self, rect:pygame.Rect, padding:float=0.05) -> None:
+        # Shows all of `rect` (world) as large as it goes, centered, with `padding` of the window left around it
+        zoom = (1 - 2*padding) * min(self.width / max(rect.width, 1), self.height / max(rect.height, 1))
+        self.zoom = min(self.max_zoom, max(self.min_zoom, zoom))
+        self.x = rect.centerx - self.width / (2 * self.zoom)
+        self.y = rect.centery - self.height / (2 * self.zoom)
+        self.version += 1
@@ -0,0 +1,504 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import pygame
+
+from world_object import Circle, ObjectSignal, BaseInteractiveObject, MouseAnchor, SimpleObjectConnection, Rectangle, TextRectangle
+from input_management import Mouse, Keyboard
+from helpers import release_active_obj
+from node_store import IS_HOVERED, IS_PREVIEWING, IS_UNTRACKED
+from picking import GeometricPicker, DepthBufferPicker
+from frame_dump import FrameDumper
+from scene import Scene
+from rendering import FullRenderer, DirtyRectRenderer, EdgeLayer, LevelOfDetail
+from profiler import FrameProfiler
+from layout import ForceLayout
+from importer import GraphImporter
+from selection import GroupSelection
+import fonts
+
+
+# Action -> key, modifiers as "ctrl+x". Override single actions through `Engine(key_bindings=...)`
+DEFAULT_KEY_BINDINGS = {"quit": "q", "place_node": "1", "delete": "x", "fit": "f", "layout": "l", "profiler_overlay": "p"}
+
+
+class Engine:
+    # Owns the window, the scene, the input state and the loop. Input and simulation run at a fixed `update_rate`,
+    # rendering at up to `max_fps`. Under load rendering is skipped (at most `max_frame_skip` frames in a row) so updates can catch up.
+    #
+    # Stand-alone:  Engine().run()
+    # Embedded:     call `tick()` from the host loop, or `process_events`/`update`/`render` directly for scripted input
+    #
+    # With `idle_mode` the stand-alone loop stops drawing once nothing changes and sleeps in `pygame.event.wait` until
+    # the next event, or until the delayed-selectable timer runs out
+    #
+    # The window shows the world through `camera`: dragging with the middle button pans, the wheel zooms and "f" fits
+    # the whole scene. Only what overlaps the window is picked and drawn, and input only reaches the object under the
+    # pointer plus whatever it has to hear from (hover ending, a drag), see `_dispatch_targets`
+    #
+    # Dragging over empty space selects the nodes in the rubber band, with shift on top of the selection so far.
+    # Dragging one of them moves the whole group, "x" deletes it, a right click or a click elsewhere drops it
+    def __init__(self, window_size=(1080, 720), screen:pygame.Surface|None=None, caption:str="Elements", headless:bool=False,
+                 picking_mode:str="geometric", render_mode:str="dirty_rects", batch_edges:bool=True, level_of_detail:bool=True,
+                 update_rate:float=120, max_fps:float=60, max_updates_per_tick:int=8, max_frame_skip:int=4,
+                 delay_selectable_seconds:float=0.2, frame_dump_dir:str|None=None, frame_dump_every_n_frames:int=30,
+                 profiler:FrameProfiler|None=None, instrument_classes:bool=True, idle_mode:bool=False,
+                 layout_budget_seconds:float=0.004, import_budget_seconds:float=0.008, zoom_step:float=1.15, cull_margin:int=32,
+                 key_bindings:Dict[str, str]|None=None):
+        # Window, an embedding tool may hand over its own surface instead
+        if screen is None:
+            if headless:
+                os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+            pygame.init()
+            screen = pygame.display.set_mode(window_size)
+            pygame.display.set_caption(caption)
+        self.screen = screen
+        self.caption = caption
+        self.owns_display = screen is pygame.display.get_surface()
+        window_size = screen.get_size()
+
+        # Camera, shared with the objects like the node store
+        self.camera = BaseInteractiveObject.camera
+        self.camera.reset(window_size)
+        self.zoom_step = zoom_step # Per wheel notch
+        self.cull_margin = cull_margin # Screen pixels around the window that still count as visible, labels spill out of their boxes
+        self._pan_grab:Tuple[float, float]|None = None # World point held by a middle button drag
+
+        # Objects
+        self.scene = Scene()
+        self.mouse = Mouse(self.camera)
+        self.keyboard = Keyboard({**DEFAULT_KEY_BINDINGS, **(key_bindings or {})})
+        self.picker = GeometricPicker(index=self.scene.index) if (picking_mode == "geometric") else DepthBufferPicker(window_size)
+        self.edge_layer = EdgeLayer(window_size) if batch_edges else None
+        self.lod = LevelOfDetail() if level_of_detail else None # Less detail the further out the camera is
+        renderer_class = DirtyRectRenderer if (render_mode == "dirty_rects") else FullRenderer
+        self.renderer = renderer_class(screen, edge_layer=self.edge_layer, lod=self.lod)
+        self.frame_dumper = FrameDumper(frame_dump_dir, frame_dump_every_n_frames).start() if frame_dump_dir else None
+        self.profiler = FrameProfiler() if (profiler is None) else profiler
+        if instrument_classes:
+            self.profiler.instrument([Rectangle, Circle, TextRectangle, SimpleObjectConnection])
+        self.scene.add_listener(self.picker)
+        self.scene.add_listener(self.renderer)
+        self.selection = GroupSelection(self.scene) # Rubber band selection, see `_update_selection`
+        self.scene.add_listener(self.selection)
+        self.scene.add_listener(self) # Forgets the active object once it leaves the scene, see `remove`
+        self.layout = ForceLayout(self.scene, center=(window_size[0] / 2, window_size[1] / 2)) # "l" starts and stops it
+        self.layout_budget_seconds = layout_budget_seconds
+        self.importers:List[GraphImporter] = [] # Files being streamed in, see `start_import`
+        self.import_budget_seconds = import_budget_seconds
+
+        # Interaction state
+        self.active_obj:BaseInteractiveObject|None = None
+        self.delayed_active:BaseInteractiveObject|None = None
+        self.delay_selectable_seconds = delay_selectable_seconds
+        self._delay_left = 0.0
+
+        # Timing
+        self.update_dt = 1 / update_rate
+        self.render_dt = (1 / max_fps) if max_fps else 0.0
+        self.max_updates_per_tick = max_updates_per_tick
+        self.max_frame_skip = max_frame_skip
+        self.max_tick_seconds = 0.25 # Longer stalls, e.g. a dragged window, aren't simulated after the fact
+        self._accumulator = 0.0
+        self._last_time:float|None = None
+        self._last_render = -float("inf")
+        self._skipped_in_row = 0
+        self.running = False
+        self.updates = 0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+        self.updates_dropped = 0
+
+        # Idle mode. After the last change a couple more frames are drawn, hover is picked from the mouse position
+        # of the previous update so it lags one step behind the motion event
+        self.idle_mode = idle_mode
+        self.settle_frames = 2
+        self.busy_checks:List[Callable[[], bool]] = [] # Anything animating on its own registers here, e.g. a running layout
+        self.busy_checks.append(self.layout.is_running)
+        self.busy_checks.append(lambda: bool(self.importers))
+        self._frames_to_settle = self.settle_frames
+        self._scene_version = self.scene.version
+        self.idle_waits = 0
+
+    #---------------------------------
+    # Events
+    #---------------------------------
+
+    def handle_event(self, event:pygame.event.Event) -> None:
+        if (event.type == pygame.KEYDOWN) or (event.type == pygame.KEYUP):
+            self.keyboard.update(event)
+        if (event.type == pygame.QUIT) or self.keyboard.is_triggered("quit"):
+            self.running = False
+        if event.type == pygame.WINDOWFOCUSLOST:
+            self.keyboard.release_all() # The key ups go to whichever window has the focus now
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            self.renderer.damage(self.screen.get_rect()) # The window system may have thrown the contents away
+        if (event.type == pygame.MOUSEWHEEL) and (self.mouse.screen_x is not None):
+            self.camera.zoom_at(self.zoom_step ** event.y, self.mouse.screen_x, self.mouse.screen_y)
+            self.mouse.refresh_position()
+
+    def remove(self, obj:BaseInteractiveObject) -> None:
+        # Scene listener. A deleted object's store row goes to the next object created, holding on to it would read and
+        # write that one's state, e.g. after a group delete took the active object along
+        if obj is self.active_obj:
+            self.active_obj = None
+        if obj is self.delayed_active:
+            self.delayed_active = None
+
+    def process_events(self, events:Iterable[pygame.event.Event]|None=None) -> None:
+        for event in (pygame.event.get() if (events is None) else events):
+            self.handle_event(event)
+        self.profiler.lap("events")
+
+    #---------------------------------
+    # Importing
+    #---------------------------------
+
+    def start_import(self, path:str, **kwargs) -> GraphImporter:
+        # Streams a CSV edge list or GraphML file into the scene over the next updates, see `GraphImporter` for the options
+        width, height = self.screen.get_size()
+        kwargs.setdefault("center", self.camera.screen_to_world(width / 2, height / 2))
+        importer = GraphImporter(self.scene, self.screen, path, **kwargs)
+        self.importers.append(importer)
+        return importer
+
+    def _update_imports(self) -> None:
+        for importer in self.importers:
+            importer.step(self.import_budget_seconds)
+        self.importers = [importer for importer in self.importers if not importer.done]
+        if self.owns_display:
+            progress = "  ".join(f"{os.path.basename(i.path)} {i.progress:.0%}" for i in self.importers)
+            caption = f"{self.caption} - importing {progress}" if progress else self.caption
+            if caption != pygame.display.get_caption()[0]:
+                pygame.display.set_caption(caption)
+
+    #---------------------------------
+    # Simulation - one fixed step
+    #---------------------------------
+
+    def _update_camera(self) -> None:
+        mouse = self.mouse
+
+        # Middle button drag, the world point grabbed on the press stays under the pointer
+        if mouse.middle_pressed:
+            if self._pan_grab is None:
+                self._pan_grab = (mouse.x, mouse.y)
+            self.camera.grab(*self._pan_grab, mouse.screen_x, mouse.screen_y)
+            mouse.refresh_position()
+        else:
+            self._pan_grab = None
+
+        # Fit the whole scene in the window
+        if self.keyboard.is_triggered("fit"):
+            self.scene.sync_index()
+            bounds = self.scene.get_bounds()
+            if bounds is not None:
+                self.camera.fit(bounds)
+                mouse.refresh_position()
+
+    def visible_objects(self) -> List[BaseInteractiveObject]:
+        # Whatever overlaps the window, in draw order, through the scene's spatial index
+        self.scene.sync_index()
+        return self.scene.query_rect(self.camera.world_rect(self.cull_margin))
+
+    def _update_placement(self) -> None:
+        mouse, keyboard = self.mouse, self.keyboard
+        self._update_camera()
+
+        # Freshly placed objects only become selectable after a short delay, so the placing click doesn't select them
+        if self.delayed_active is not None:
+            self._delay_left -= self.update_dt
+            if self._delay_left <= 0:
+                for obj in self.delayed_active.get_all_objects(including_self=True):
+                    obj.is_active = True
+                self.delayed_active = None
+
+        # User keyboard input
+        release_active_obj_for_placement = self.active_obj and (not self.active_obj.is_under_placement)
+        no_active_obj = self.active_obj is None
+        if keyboard.is_triggered("place_node") and (release_active_obj_for_placement or no_active_obj):
+            release_active_obj(self.active_obj)
+            self.active_obj = Circle(self.screen, 0, 0, radius=50, depth=50, anchor=mouse)
+            self.active_obj.is_under_placement = True
+            self.active_obj.is_previewing = True
+            for obj in self.active_obj.get_all_objects():
+                obj.is_active = False
+            self.scene.add(self.active_obj)
+
+        # Placement
+        if self.active_obj and self.active_obj.is_under_placement and mouse.left_pressed:
+            self.active_obj.is_under_placement = False
+            self.active_obj.is_previewing = False
+            self.active_obj.is_selected = False
+            self.active_obj.anchor = None
+            self.delayed_active = self.active_obj
+            self._delay_left = self.delay_selectable_seconds
+            self.active_obj = None
+
+        # Object deletion, a group selection goes all at once
+        if keyboard.is_triggered("delete") and self.active_obj and self.active_obj.is_deletable:
+            self.scene.delete(self.active_obj)
+            self.active_obj = None
+        elif keyboard.is_triggered("delete") and self.selection:
+            self.selection.delete()
+
+        # Profiler overlay
+        if keyboard.is_triggered("profiler_overlay"):
+            self.profiler.toggle_overlay()
+
+        # Auto-layout
+        if keyboard.is_triggered("layout"):
+            self.layout.toggle()
+
+    def _update_selection(self, picked:BaseInteractiveObject|None) -> BaseInteractiveObject|None:
+        # Rubber band and group drags. Returns what the objects get to see as picked: nothing while the group has the
+        # mouse, so a member isn't dragged on its own on top of the group
+        mouse, selection = self.mouse, self.selection
+        if selection.is_banding():
+            if mouse.left_pressed:
+                selection.update_band(mouse.x, mouse.y)
+            else:
+                selection.end_band(add=self.keyboard.shift)
+            return None
+        if selection.is_dragging():
+            if mouse.left_pressed:
+                selection.drag_to(mouse.x, mouse.y)
+                return None
+            selection.end_drag()
+
+        clicked = mouse.left_pressed and (not mouse.left_held)
+        if mouse.right_pressed:
+            selection.clear()
+        elif clicked and (picked is not None) and (picked in selection):
+            selection.begin_drag(mouse.x, mouse.y)
+            return None
+        elif clicked:
+            if not self.keyboard.shift:
+                selection.clear()
+            # On empty space a new band starts, unless it's the click that just placed a node
+            if (picked is None) and (self.active_obj is None) and (self.delayed_active is None):
+                selection.begin_band(mouse.x, mouse.y)
+        return picked
+
+    def _dispatch_targets(self, picked:BaseInteractiveObject|None) -> List[BaseInteractiveObject]:
+        # Only the picked object can become hovered, selected or interacted with, every other object would just hear
+        # it isn't. Besides it that leaves the objects still flagged as hovered, which have to hear hover ended, and
+        # whatever follows the mouse (a drag, the placement preview), wherever it is. A handful, however large the scene
+        store = BaseInteractiveObject.node_store
+        targets = set(store.objects(store.slots(any_flags=IS_HOVERED | IS_UNTRACKED | IS_PREVIEWING)))
+        if picked is not None:
+            targets.add(picked)
+        return self.scene.in_draw_order(targets)
+
+    def _update_objects(self, depth_sorted_objects:List[BaseInteractiveObject], picked:BaseInteractiveObject|None) -> None:
+        mouse, keyboard, active_obj = self.mouse, self.keyboard, self.active_obj
+
+        # Release object upon right click, wherever the mouse is
+        if active_obj and mouse.right_pressed:
+            active_obj = release_active_obj(active_obj)
+
+        for obj in depth_sorted_objects:
+            if not obj.is_active:
+                continue
+
+            signal:ObjectSignal = obj.respond(mouse, keyboard, picked)
+
+            # Selection
+            if (active_obj is None) and signal.selected:
+                obj.is_selected = signal.selected
+                active_obj = obj
+
+            # Hover
+            if (active_obj is not None) and (obj != active_obj) and mouse.left_pressed:
+                obj.is_hovered = False
+
+            # Drag object
+            activate_drag = (obj.is_hovered and obj.is_selected and mouse.left_pressed and obj.is_movable) or obj.is_previewing
+            if isinstance(obj.anchor, MouseAnchor) and (not mouse.left_held):
+                obj.anchor = obj.old_anchor
+            if (not isinstance(obj.anchor, MouseAnchor)) and activate_drag:
+                obj.old_anchor = obj.anchor
+                obj.anchor = MouseAnchor(mouse, offset_x=obj.x - mouse.x, offset_y=obj.y - mouse.y)
+
+            # Interact with another object
+            if (not activate_drag) and (active_obj is not None) and (active_obj != obj) and signal.hovered and mouse.left_pressed and (not mouse.left_held):
+                new_interaction_obj = active_obj.interact(obj)
+                if new_interaction_obj is None:
+                    continue
+                elif isinstance(new_interaction_obj, SimpleObjectConnection):
+                    active_obj.add_bond("i_am_in_connection_with", new_interaction_obj, add_to_other_as_well=True)
+                    obj.add_bond("i_am_in_connection_with", new_interaction_obj, add_to_other_as_well=True)
+                    self.scene.add(new_interaction_obj)
+                else:
+                    print(new_interaction_obj)
+                    raise NotImplementedError
+        self.active_obj = active_obj
+
+    def update(self, mouse_pos=None, mouse_pressed=None) -> None:
+        # `mouse_pos`/`mouse_pressed` default to the real mouse, see `Mouse.end_of_tick_update`
+        profiler = self.profiler
+        self._update_placement()
+        profiler.lap("placement")
+
+        self.layout.step(self.layout_budget_seconds)
+        profiler.lap("layout")
+
+        if self.importers:
+            self._update_imports()
+        profiler.lap("import")
+
+        if self.picker.needs_sync:
+            self.picker.sync(self.visible_objects())
+        else:
+            self.scene.sync_index()
+        picked = self._update_selection(self.picker.pick(self.mouse.x, self.mouse.y))
+        depth_sorted_objects = self._dispatch_targets(picked)
+        profiler.lap("depth_build")
+
+        self._update_objects(depth_sorted_objects, picked)
+        profiler.lap("respond")
+
+        self.mouse.end_of_tick_update(mouse_pos, mouse_pressed)
+        self.keyboard.end_of_tick_update()
+        store = BaseInteractiveObject.node_store
+        store.end_of_tick_update() # Derived geometry recomputed vs. reused from the cache, shown by the profiler
+        profiler.count("geometry_recomputed", store.last_tick["recomputed"])
+        profiler.count("geometry_reused", store.last_tick["reused"])
+        self.updates += 1
+        profiler.lap("input")
+
+    #---------------------------------
+    # Rendering
+    #---------------------------------
+
+    def render(self) -> None:
+        profiler = self.profiler
+        for rect in profiler.overlay_damage() + self.selection.band_damage():
+            self.renderer.damage(rect)
+        self.renderer.draw(self.visible_objects())
+        self.selection.draw_band(self.screen)
+        profiler.draw_overlay(self.screen)
+        profiler.lap("draw")
+
+        if self.owns_display:
+            self.renderer.present()
+        profiler.lap("flip")
+
+        # Debug dump, the geometric picker has no pick buffer so the screen is dumped instead
+        if self.frame_dumper:
+            self.frame_dumper.submit(getattr(self.picker, "surface", self.screen))
+        self.frames_rendered += 1
+        profiler.lap("dump")
+
+    #---------------------------------
+    # Loop
+    #---------------------------------
+
+    def is_busy(self) -> bool:
+        # True while the picture can change without any new event: buttons held (dragging), a placement preview,
+        # an unhandled key press, the profiler overlay or a registered animation
+        mouse = self.mouse
+        if mouse.left_pressed or mouse.middle_pressed or mouse.right_pressed:
+            return True
+        if (self.active_obj is not None) and self.active_obj.is_under_placement:
+            return True
+        if self.keyboard.events or self.profiler.show_overlay:
+            return True
+        return any(check() for check in self.busy_checks)
+
+    def wake(self) -> None:
+        # Redraw even though no event came in, e.g. after the host changed the scene
+        self._frames_to_settle = self.settle_frames
+
+    def wait_for_event(self, max_seconds:float|None=None) -> None:
+        # Blocks until there's input, the delayed-selectable timer runs out or `max_seconds` pass
+        timeouts = [] if (max_seconds is None) else [max_seconds]
+        if self.delayed_active is not None:
+            timeouts.append(self._delay_left)
+        timeout_ms = max(1, int(min(timeouts) * 1000) + 1) if timeouts else 0 # 0 waits for good
+        start = time.perf_counter()
+        event = pygame.event.wait(timeout_ms)
+        if event.type != pygame.NOEVENT:
+            pygame.event.post(event) # Handled by the next `tick` along with whatever follows it
+        slept = time.perf_counter() - start
+        self.idle_waits += 1
+
+        # Sleeping isn't simulated: the delay is counted down by hand, the mouse mustn't see the gap as a held button
+        # and the accumulator starts over with one update due
+        if self.delayed_active is not None:
+            self._delay_left -= slept
+        self.mouse.resume()
+        self._last_time = time.perf_counter() - self.update_dt
+        self._accumulator = 0.0
+        self.wake()
+
+    def tick(self) -> float:
+        # Runs every update that's due, then renders if a frame is due. Returns the seconds until there's work again
+        now = time.perf_counter()
+        if self._last_time is None:
+            self._last_time = now - self.update_dt
+        self._accumulator += min(now - self._last_time, self.max_tick_seconds)
+        self._last_time = now
+        events = pygame.event.get()
+        self.process_events(events)
+        if events or (self.scene.version != self._scene_version) or self.is_busy():
+            self._scene_version = self.scene.version
+            self.wake()
+
+        updates = 0
+        while (self._accumulator >= self.update_dt) and (updates < self.max_updates_per_tick):
+            self.update()
+            self._accumulator -= self.update_dt
+            updates += 1
+
+        # Behind schedule, skip drawing for a few frames so the simulation can catch up. Past that, drop the backlog
+        behind = self._accumulator >= self.update_dt
+        if behind and (self._skipped_in_row < self.max_frame_skip):
+            self._skipped_in_row += 1
+            self.frames_skipped += 1
+        elif ((now - self._last_render) >= self.render_dt) and ((not self.idle_mode) or self._frames_to_settle):
+            self.render()
+            self._last_render = now
+            self._skipped_in_row = 0
+            self._frames_to_settle = max(0, self._frames_to_settle - 1)
+            if behind:
+                dropped = int(self._accumulator // self.update_dt)
+                self._accumulator -= dropped * self.update_dt
+                self.updates_dropped += dropped
+        self.profiler.end_frame()
+
+        next_update = self.update_dt - self._accumulator
+        next_render = self.render_dt - (time.perf_counter() - self._last_render)
+        return max(0.0, min(next_update, next_render))
+
+    def run(self, max_seconds:float|None=None) -> None:
+        self.running = True
+        start = time.perf_counter()
+        try:
+            while self.running:
+                idle = self.tick()
+                elapsed = time.perf_counter() - start
+                if (max_seconds is not None) and (elapsed >= max_seconds):
+                    break
+                if self.idle_mode and (not self._frames_to_settle) and (not self.is_busy()):
+                    self.wait_for_event(None if (max_seconds is None) else (max_seconds - elapsed))
+                elif idle > 0.001:
+                    time.sleep(idle)
+                self.profiler.lap("idle")
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.running = False
+        for importer in self.importers:
+            importer.close()
+        if self.frame_dumper:
+            self.frame_dumper.stop()
+        self.profiler.close_trace()
+        self.profiler.disable()
+        if self.owns_display:
+            fonts.reset()
+            pygame.quit()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import pygame
+
+
+###################################################################
+# Font registry
+###################################################################
+
+
+_fonts:Dict[Tuple[str|None, int], pygame.font.Font] = {}
+
+def get_font(face:str|None, size:int) -> pygame.font.Font:
+    # `SysFont` is slow (it may scan the system fonts), so every (face, size) is only ever built once
+    key = (face, size)
+    font = _fonts.get(key)
+    if font is None:
+        font = pygame.font.SysFont(face, size) # None uses the default font
+        _fonts[key] = font
+    return font
+
+
+###################################################################
+# Rendered label cache
+###################################################################
+
+
+class LabelCache:
+    def __init__(self, max_bytes:int=32 * 1024**2):
+        self.max_bytes = max_bytes
+        self.surfaces:OrderedDict[tuple, pygame.Surface] = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    @staticmethod
+    def _surface_bytes(surface:pygame.Surface) -> int:
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def render(self, text:str, face:str|None, size:int, color, antialias:bool=True) -> pygame.Surface:
+        key = (text, face, size, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = get_font(face, size).render(text, antialias, color)
+        self.surfaces[key] = surface
+        self.bytes_used += self._surface_bytes(surface)
+
+        # Least recently used labels go first, the one just rendered is always kept
+        while (self.bytes_used > self.max_bytes) and (len(self.surfaces) > 1):
+            _, evicted = self.surfaces.popitem(last=False)
+            self.bytes_used -= self._surface_bytes(evicted)
+            self.evictions += 1
+        return surface
+
+    def clear(self) -> None:
+        self.surfaces.clear()
+        self.bytes_used = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"labels": len(self.surfaces), "bytes_used": self.bytes_used, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0}
+
+
+label_cache = LabelCache()
+
+
+def reset() -> None:
+    # Fonts and rendered labels don't survive `pygame.quit`, call this before quitting if pygame may be started again
+    _fonts.clear()
+    label_cache.clear()
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import warnings
+
+import numpy as np
+import pygame
+
+
+###################################################################
+# PNG encoders - imported lazily, only once dumping is turned on
+###################################################################
+
+
+def _load_png_writer():
+    try:
+        import cv2
+    except ImportError:
+        cv2 = None
+
+    if cv2 is not None:
+        def write(path:str, frame:np.ndarray):
+            if not cv2.imwrite(path, np.ascontiguousarray(frame[:, :, ::-1])): # cv2 expects BGR, and reports failure instead of raising
+                raise OSError(f"cv2 could not write {path}")
+        return write
+
+    def write(path:str, frame:np.ndarray):
+        pygame.image.save(pygame.surfarray.make_surface(frame.transpose((1, 0, 2))), path)
+    return write
+
+
+###################################################################
+# Dumper
+###################################################################
+
+
+class FrameDumper:
+    def __init__(self, output_dir:str, every_n_frames:int=30, max_queued_frames:int=8, file_name:str="depth_{:06d}.png"):
+        assert every_n_frames >= 1
+        self.output_dir = output_dir
+        self.every_n_frames = every_n_frames
+        self.file_name = file_name
+        self.queue = queue.Queue(maxsize=max_queued_frames)
+
+        self.frames_seen = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.frames_failed = 0 # Encoding or writing raised, e.g. a full disk. The writer carries on with the next frame
+        self.last_error:Exception|None = None
+
+        self._write_png = None
+        self._thread:threading.Thread|None = None
+
+    @property
+    def is_running(self):
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def start(self) -> FrameDumper:
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._write_png = _load_png_writer()
+        self._thread = threading.Thread(target=self._run, name="FrameDumper", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout:float=5.0) -> None:
+        # What's queued gets up to `timeout` seconds to be written. Shutting down never blocks on a slow disk: with the
+        # queue full the oldest frame makes room for the stop signal, and a writer that's still busy is left behind
+        if not self.is_running:
+            return
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                break
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                self.frames_dropped += 1
+            except queue.Empty:
+                pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, surface:pygame.Surface) -> bool:
+        frame_index = self.frames_seen
+        self.frames_seen += 1
+        if (frame_index % self.every_n_frames) != 0 or (not self.is_running):
+            return False
+
+        # Drop instead of waiting for a slow disk, the render loop must never block here
+        if self.queue.full():
+            self.frames_dropped += 1
+            return False
+        frame = pygame.surfarray.array3d(surface).transpose((1, 0, 2))
+        try:
+            self.queue.put_nowait((frame_index, frame))
+        except queue.Full:
+            self.frames_dropped += 1
+            return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            frame_index, frame = item
+            path = os.path.join(self.output_dir, self.file_name.format(frame_index))
+            try:
+                self._write_png(path, frame)
+            except Exception as error:
+                self.frames_failed += 1
+                self.last_error = error
+                warnings.warn(f"Frame dump to {path} failed: {error!r}")
+                continue
+            self.frames_written += 1
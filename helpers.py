@@ -1,5 +1,8 @@
-import numpy as np
+import gc
 import math
+from contextlib import contextmanager
+
+import numpy as np
 
 COLORS = {
     'blue': (31, 119, 180),
@@ -49,10 +52,31 @@ def angle_between_points_rad(p1, p2):
         theta = np.arccos((p2.x-p1.x)/r)
     return theta
 
+def point_segment_distance(px, py, x1, y1, x2, y2):
+    dx, dy = x2-x1, y2-y1
+    length_squared = dx*dx + dy*dy
+    t = 0
+    if length_squared > 0:
+        t = max(0, min(1, ((px-x1)*dx + (py-y1)*dy) / length_squared))
+    cx, cy = x1 + t*dx, y1 + t*dy
+    return ((px-cx)**2 + (py-cy)**2)**0.5
+
 def release_active_obj(active_obj):
     if active_obj is None:
         return
     active_obj.is_selected = False
     active_obj.anchor = active_obj.old_anchor
 
+@contextmanager
+def gc_paused():
+    # Building a large scene allocates so many objects that the cyclic garbage collector keeps running over all of them,
+    # for nothing since none of them is garbage yet
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
 rad2deg = math.degrees
\ No newline at end of file
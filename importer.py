@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import csv
+import io
+import math
+import os
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+import pygame
+
+from helpers import gc_paused
+from world_object import BaseInteractiveObject, Circle, SimpleObjectConnection
+from scene import Scene
+
+
+# Usage: engine.start_import("graph.csv") or, without an engine, GraphImporter(scene, screen, "graph.graphml").run()
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+HEADER_NAMES = {"source", "target", "from", "to", "src", "dst", "node1", "node2", "u", "v"} # Column names an edge list header is recognized by
+
+
+###################################################################
+# Readers - yield the file chunk by chunk, never all of it at once
+###################################################################
+
+
+class GraphChunk:
+    def __init__(self):
+        # Nodes declared explicitly (GraphML), with their position if the file has one (NaN otherwise)
+        self.node_ids:List[str] = []
+        self.node_x:List[float] = []
+        self.node_y:List[float] = []
+        # Edges by node ID, nodes only seen in an edge are created on the fly
+        self.sources:List[str] = []
+        self.targets:List[str] = []
+
+    def __len__(self):
+        return len(self.node_ids) + len(self.sources)
+
+
+def _sniff_dialect(sample:str, delimiters:str) -> type[csv.Dialect]|csv.Dialect:
+    # Comment lines throw the sniffer off. If it still can't tell, the first delimiter the first line holds is taken
+    lines = [line for line in sample.splitlines(keepends=True) if not line.startswith("#")]
+    try:
+        return csv.Sniffer().sniff("".join(lines), delimiters=delimiters)
+    except csv.Error:
+        pass
+    first = lines[0] if lines else ""
+    dialect = type("EdgeListDialect", (csv.excel,), {})
+    dialect.delimiter = next((d for d in delimiters if d in first), ",")
+    return dialect
+
+
+def read_edge_list(file:io.BufferedReader, chunk_size:int, delimiter:str|None=None, has_header:bool|None=None) -> Iterator[GraphChunk]:
+    # "source,target" per line, further columns (weights etc.) are ignored. The delimiter is sniffed from the first lines,
+    # spaces only when asked for since node names may contain them. Without `has_header` the first row is only taken
+    # for a header if its first two columns are known names, e.g. "source,target"
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    sample = text.read(4096)
+    text.seek(0)
+    rows = csv.reader(text, _sniff_dialect(sample, delimiter or ",;\t"))
+
+    chunk = GraphChunk()
+    first = True
+    for row in rows:
+        if first and (len(row) >= 2) and not row[0].startswith("#"):
+            first = False
+            is_header = has_header if (has_header is not None) else {row[0].strip().lower(), row[1].strip().lower()} <= HEADER_NAMES
+            if is_header:
+                continue
+        if (len(row) < 2) or row[0].startswith("#"):
+            continue
+        chunk.sources.append(row[0].strip())
+        chunk.targets.append(row[1].strip())
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = GraphChunk()
+    if len(chunk):
+        yield chunk
+
+
+def read_graphml(file:io.BufferedReader, chunk_size:int) -> Iterator[GraphChunk]:
+    # Elements are dropped as soon as they're read. Node attributes named "x" and "y" (e.g. from yEd or Gephi) are used as positions
+    position_keys:Dict[str, str] = {} # key id -> "x"/"y"
+    chunk = GraphChunk()
+    parser = ET.iterparse(file, events=("start", "end"))
+    _, root = next(parser)
+    parent = root # Whatever holds the nodes and edges read so far, cleared as it goes
+    for event, element in parser:
+        tag = element.tag.rsplit("}", 1)[-1] # Without the namespace
+        if event == "start":
+            if tag == "graph":
+                parent = element
+            continue
+        if (tag == "key") and (element.get("attr.name") in ("x", "y")) and (element.get("for") in ("node", "all", None)):
+            position_keys[element.get("id")] = element.get("attr.name")
+        elif tag == "node":
+            position = {"x": math.nan, "y": math.nan}
+            for data in element:
+                if data.get("key") in position_keys:
+                    try:
+                        position[position_keys[data.get("key")]] = float(data.text)
+                    except (TypeError, ValueError):
+                        pass
+            chunk.node_ids.append(element.get("id"))
+            chunk.node_x.append(position["x"])
+            chunk.node_y.append(position["y"])
+        elif tag == "edge":
+            chunk.sources.append(element.get("source"))
+            chunk.targets.append(element.get("target"))
+        else:
+            continue
+        parent.clear() # Done with everything read so far
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = GraphChunk()
+    if len(chunk):
+        yield chunk
+
+
+###################################################################
+# Importer
+###################################################################
+
+
+class GraphImporter:
+    # Streams a graph file into the scene a chunk at a time, so drawing can go on while a large file is read.
+    # Nodes without a position in the file are laid out on a sunflower spiral around `center`, "l" tidies them up
+    def __init__(self, scene:Scene, screen:pygame.Surface, path:str, file_format:str|None=None, chunk_size:int=1000,
+                 center:Tuple[float, float]=(540, 360), spacing:float=60, radius:int=20,
+                 delimiter:str|None=None, has_header:bool|None=None, on_progress:Callable[[GraphImporter], None]|None=None):
+        self.scene = scene
+        self.screen = screen
+        self.path = path
+        self.file_format = file_format or ("graphml" if path.lower().endswith((".graphml", ".xml")) else "edge_list")
+        self.chunk_size = chunk_size
+        self.center = center
+        self.spacing = spacing
+        self.radius = radius
+        self.delimiter = delimiter # Edge lists only, None sniffs it from the first lines. Spaces have to be asked for, e.g. " "
+        self.has_header = has_header # Edge lists only, None recognizes a header by its column names
+        self.on_progress = on_progress
+
+        self.nodes:Dict[str, Circle] = {}
+        self.edge_count = 0
+        self.skipped_edges = 0 # Self loops and duplicates
+        self.done = False
+        self.file_size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._chunks = read_graphml(self._file, chunk_size) if (self.file_format == "graphml") else read_edge_list(self._file, chunk_size, delimiter, has_header)
+
+    @property
+    def progress(self) -> float:
+        # Share of the file read so far
+        if self.done:
+            return 1.0
+        return min(1.0, self._file.tell() / max(self.file_size, 1)) if not self._file.closed else 1.0
+
+    def is_running(self) -> bool:
+        return not self.done
+
+    def close(self) -> None:
+        self.done = True
+        self._file.close()
+
+    #---------------------------------
+    # Chunks
+    #---------------------------------
+
+    def _spiral_positions(self, n:int) -> Tuple[np.ndarray, np.ndarray]:
+        # Continues the spiral where the previous chunk left off
+        i = np.arange(len(self.nodes), len(self.nodes) + n) + 1
+        r, angle = self.spacing * np.sqrt(i), i * GOLDEN_ANGLE
+        return self.center[0] + r * np.cos(angle), self.center[1] + r * np.sin(angle)
+
+    def _create_nodes(self, ids:List[str], x:List[float]|None=None, y:List[float]|None=None) -> List[Circle]:
+        # A circle for every ID not seen before, in order of first appearance
+        first:Dict[str, int] = {}
+        for i, node_id in enumerate(ids):
+            if (node_id not in self.nodes) and (node_id not in first):
+                first[node_id] = i
+        if not first:
+            return []
+        node_x, node_y = self._spiral_positions(len(first))
+        if x is not None:
+            rows = list(first.values())
+            given_x, given_y = np.asarray(x, np.float64)[rows], np.asarray(y, np.float64)[rows]
+            node_x = np.where(np.isnan(given_x), node_x, given_x)
+            node_y = np.where(np.isnan(given_y), node_y, given_y)
+        circles = Circle.bulk_create(self.screen, node_x, node_y, self.radius, depth=1)
+        self.nodes.update(zip(first, circles))
+        return circles
+
+    def _create_edges(self, sources:List[str], targets:List[str]) -> List[SimpleObjectConnection]:
+        connection_index = BaseInteractiveObject.connection_index
+        nodes = self.nodes
+        objs1, objs2, seen = [], [], set()
+        for source, target in zip(sources, targets):
+            node1, node2 = nodes[source], nodes[target]
+            pair = frozenset((node1, node2))
+            if (node1 is node2) or (pair in seen) or (connection_index.between(node1, node2) is not None):
+                self.skipped_edges += 1
+                continue
+            seen.add(pair)
+            objs1.append(node1)
+            objs2.append(node2)
+        self.edge_count += len(objs1)
+        return SimpleObjectConnection.bulk_create(self.screen, objs1, objs2)
+
+    def _import_chunk(self, chunk:GraphChunk) -> None:
+        with gc_paused():
+            circles = self._create_nodes(chunk.node_ids, chunk.node_x, chunk.node_y)
+            circles += self._create_nodes(chunk.sources + chunk.targets)
+            edges = self._create_edges(chunk.sources, chunk.targets)
+            self.scene.add_many(circles + edges)
+
+    def step(self, budget_seconds:float=0.01) -> None:
+        # At least one chunk per call, then more until the time budget is used up
+        deadline = time.perf_counter() + budget_seconds
+        while not self.done:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.close()
+            else:
+                self._import_chunk(chunk)
+            if self.on_progress:
+                self.on_progress(self)
+            if time.perf_counter() >= deadline:
+                return
+
+    def run(self) -> GraphImporter:
+        # Everything at once, for scripts
+        while not self.done:
+            self.step(float("inf"))
+        return self
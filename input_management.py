@@ -1,42 +1,108 @@
+from __future__ import annotations
+
+from typing import Dict, List, Set, Tuple
+
 import pygame
 
+
+# Key names as in pygame without the "K_" prefix ("a", "1", "SPACE", "F1", "LEFT"), longer names in lower case too ("space")
+KEY_CODES:Dict[str, int] = {name[2:]: code for name, code in vars(pygame).items() if name.startswith("K_")}
+KEY_CODES.update({name.lower(): code for name, code in list(KEY_CODES.items()) if len(name) > 1})
+MODIFIERS = {"alt": pygame.KMOD_ALT, "ctrl": pygame.KMOD_CTRL, "shift": pygame.KMOD_SHIFT}
+
+
+def parse_binding(spec:str) -> Tuple[int, Tuple[bool|None, bool|None, bool|None]]:
+    # "x", "ctrl+z", "ctrl+shift+s" -> (key code, (alt, ctrl, shift)), True for the modifiers that must be held
+    *modifiers, key = spec.lower().split("+") if len(spec) > 1 else [spec]
+    required = tuple(True if (name in modifiers) else None for name in MODIFIERS)
+    assert set(modifiers) <= set(MODIFIERS), f"Unknown modifier in key binding {spec!r}"
+    return KEY_CODES[key], required
+
+
 class Keyboard:
-    def __init__(self):
-        self.pressed = False
-        self.released = False
-        self.alt = False
-        self.ctrl = False
-        self.shift = False
-        self.event = None
-
-    def is_pressed(self, key:str, alt=None, ctr=None, shift=None):
-        assert len(key) == 1
-        if self.event:
-            return self.event.key == eval(f"pygame.K_{key}")
-        return False
+    # Every key event of a tick is kept: `pressed` and `released` hold the keys that went down/up since the last update,
+    # `held` the keys that are down right now. `pressed` maps each key to the modifiers held when it went down
+    def __init__(self, bindings:Dict[str, str]|None=None):
+        self.pressed:Dict[int, int] = {}
+        self.released:Set[int] = set()
+        self.held:Set[int] = set()
+        self.events:List[pygame.event.Event] = []
+        self.mods = 0 # Modifiers held as of the latest event
+        self.bindings:Dict[str, Tuple[int, Tuple[bool|None, bool|None, bool|None]]] = {} # Action -> (key code, (alt, ctrl, shift)), see `bind`
+        for action, spec in (bindings or {}).items():
+            self.bind(action, spec)
+
+    @property
+    def alt(self) -> bool:
+        return bool(self.mods & pygame.KMOD_ALT)
+
+    @property
+    def ctrl(self) -> bool:
+        return bool(self.mods & pygame.KMOD_CTRL)
+
+    @property
+    def shift(self) -> bool:
+        return bool(self.mods & pygame.KMOD_SHIFT)
+
+    def bind(self, action:str, spec:str) -> None:
+        # E.g. bind("delete", "x") or bind("save", "ctrl+s"), then `is_triggered("save")` once per press
+        self.bindings[action] = parse_binding(spec)
+
+    def is_triggered(self, action:str) -> bool:
+        # Its key went down this tick with the bound modifiers held. Unbound actions never trigger
+        binding = self.bindings.get(action)
+        return (binding is not None) and self._pressed_with(binding[0], *binding[1])
+
+    def is_pressed(self, key:str, alt:bool|None=None, ctrl:bool|None=None, shift:bool|None=None) -> bool:
+        # Went down this tick. A modifier set to True/False must have been held/not held at the time, None doesn't matter
+        return self._pressed_with(KEY_CODES[key], alt, ctrl, shift)
+
+    def _pressed_with(self, code:int, alt:bool|None, ctrl:bool|None, shift:bool|None) -> bool:
+        mods = self.pressed.get(code)
+        if mods is None:
+            return False
+        for wanted, bits in zip((alt, ctrl, shift), MODIFIERS.values()):
+            if (wanted is not None) and (bool(mods & bits) != wanted):
+                return False
+        return True
+
+    def is_released(self, key:str) -> bool:
+        return KEY_CODES[key] in self.released
+
+    def is_held(self, key:str) -> bool:
+        return KEY_CODES[key] in self.held
+
+    def release_all(self) -> None:
+        # E.g. when the window loses focus, the key ups would go elsewhere
+        self.released.update(self.held)
+        self.held.clear()
+        self.mods = 0
 
     def end_of_tick_update(self):
-        self.pressed, self.released, self.alt, self.ctrl, self.shift = [False] * 5
-        self.event = None
+        # Held keys and modifiers carry over, presses and releases were handled
+        self.pressed.clear()
+        self.released.clear()
+        self.events.clear()
 
     def update(self, event):
-        self.event = event
+        self.events.append(event)
+        self.mods = event.mod
         if event.type == pygame.KEYDOWN:
-            self.pressed = True
-        if event.type == pygame.KEYUP:
-            self.released = True
-        if event.mod & pygame.KMOD_SHIFT:
-            self.shift = True
-        if event.mod & pygame.KMOD_CTRL:
-            self.ctrl = True
-        if event.mod & pygame.KMOD_ALT:
-            self.alt = True
+            self.pressed.setdefault(event.key, event.mod) # Key repeat doesn't overwrite the first press
+            self.held.add(event.key)
+        elif event.type == pygame.KEYUP:
+            self.released.add(event.key)
+            self.held.discard(event.key)
 
 class Mouse:
-    def __init__(self):
+    def __init__(self, camera=None):
+        # `x`/`y` are in world coordinates through `camera`, `screen_x`/`screen_y` in window pixels
+        self.camera = camera
         self.x = None
         self.y = None
-        self._last_update_time = pygame.time.get_ticks()
+        self.screen_x = None
+        self.screen_y = None
+        self._last_update_time = pygame.time.get_ticks() / 1000
         self._double_click_max_interval_seconds = 0.4
         self._last_time_left_pressed = -999
 
@@ -53,10 +119,22 @@ class Mouse:
 
         self.end_of_tick_update()
 
+    def resume(self):
+        # Called after the loop slept waiting for input, so the time asleep isn't counted as time a button was pressed
+        self._last_update_time = pygame.time.get_ticks() / 1000
 
-    def end_of_tick_update(self):
-        self.x, self.y = pygame.mouse.get_pos()
-        left_pressed, middle_pressed, right_pressed = pygame.mouse.get_pressed()
+    def refresh_position(self):
+        # World position under the pointer, again after the camera moved
+        if self.camera is None:
+            self.x, self.y = self.screen_x, self.screen_y
+        else:
+            self.x, self.y = self.camera.screen_to_world(self.screen_x, self.screen_y)
+
+    def end_of_tick_update(self, pos=None, pressed=None):
+        # `pos` and `pressed` default to the real mouse, scripted input (e.g. the benchmarks) passes its own
+        self.screen_x, self.screen_y = pygame.mouse.get_pos() if (pos is None) else pos
+        self.refresh_position()
+        left_pressed, middle_pressed, right_pressed = pygame.mouse.get_pressed() if (pressed is None) else pressed
         current_time_seconds = pygame.time.get_ticks() / 1000
         update_time_delta = (current_time_seconds - self._last_update_time)
 
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from node_store import IS_ANCHORED, IS_PINNED
+from world_object import BaseInteractiveObject, Circle, SimpleObjectConnection
+
+
+###################################################################
+# Barnes-Hut quadtree
+###################################################################
+
+
+def _spread_bits(v:np.ndarray) -> np.ndarray:
+    # 16 bit integers -> 32 bit with a zero between every bit, for interleaving into Morton codes
+    v = v.astype(np.int64) & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+class QuadTree:
+    # Linear quadtree built from Morton codes, one set of arrays per level. Level `l` has a row per non-empty cell with
+    # the number of bodies in it and their centre of mass. The children of a cell are a contiguous range on the next level
+    def __init__(self, x:np.ndarray, y:np.ndarray, max_depth:int=12):
+        n = len(x)
+        self.depth = int(min(max_depth, 16, np.ceil(np.log(max(n, 1)) / np.log(4)) + 2))
+        self.left, self.top = float(x.min()), float(y.min())
+        self.size = max(float(x.max()) - self.left, float(y.max()) - self.top, 1.0) * 1.0001 # Every body strictly inside
+
+        side = 1 << self.depth
+        ix = np.minimum(((x - self.left) * (side / self.size)).astype(np.int64), side - 1)
+        iy = np.minimum(((y - self.top) * (side / self.size)).astype(np.int64), side - 1)
+        self.codes = (_spread_bits(ix) << 1) | _spread_bits(iy) # Per body, at the deepest level
+
+        order = np.argsort(self.codes, kind="stable")
+        codes, xs, ys = self.codes[order], x[order], y[order]
+        self.levels:List[Tuple[np.ndarray, ...]] = []
+        for level in range(self.depth + 1):
+            level_codes = codes >> (2 * (self.depth - level))
+            starts = np.flatnonzero(np.r_[True, level_codes[1:] != level_codes[:-1]])
+            mass = np.diff(np.r_[starts, n])
+            cells = level_codes[starts]
+            self.levels.append((cells, mass, np.add.reduceat(xs, starts) / mass, np.add.reduceat(ys, starts) / mass))
+
+        # Child ranges, the children of cell `c` have codes c*4 .. c*4+3 on the next level
+        self.children:List[Tuple[np.ndarray, np.ndarray]] = []
+        for level in range(self.depth):
+            cells, next_cells = self.levels[level][0], self.levels[level + 1][0]
+            self.children.append((np.searchsorted(next_cells, cells * 4), np.searchsorted(next_cells, cells * 4 + 4)))
+
+    def repulsion(self, bodies:np.ndarray, x:np.ndarray, y:np.ndarray, theta:float, min_distance:float) -> Tuple[np.ndarray, np.ndarray]:
+        # Sum of mass / distance pushing away from every other body, for the tree bodies at index `bodies`.
+        # Walks all of them down the tree at once, a cell that looks smaller than `theta` from a body counts as one body
+        n = len(bodies)
+        fx, fy = np.zeros(n), np.zeros(n)
+        px, py, body_codes = x[bodies], y[bodies], self.codes[bodies]
+        query, cell = np.arange(n), np.zeros(n, np.intp)
+        for level, (cells, mass, cx, cy) in enumerate(self.levels):
+            if not len(query):
+                break
+
+            # The cell a body sits in is looked at without that body
+            own = (body_codes[query] >> (2 * (self.depth - level))) == cells[cell]
+            m = mass[cell] - own
+            qx, qy = px[query], py[query]
+            mx = np.where(own, (cx[cell] * mass[cell] - qx) / np.maximum(m, 1), cx[cell])
+            my = np.where(own, (cy[cell] * mass[cell] - qy) / np.maximum(m, 1), cy[cell])
+            dx, dy = qx - mx, qy - my
+            d = np.sqrt(dx*dx + dy*dy) + 1e-9
+
+            cell_size = self.size / (1 << level)
+            accept = ((~own) & (cell_size < theta * d)) if (level < self.depth) else np.ones(len(query), bool)
+            k = np.where(accept & (m > 0), m / (d * np.maximum(d, min_distance)), 0.0) # Unit direction times m / d
+            fx += np.bincount(query, k * dx, minlength=n)
+            fy += np.bincount(query, k * dy, minlength=n)
+
+            # Everything too close to approximate is opened up on the next level
+            if level == self.depth:
+                break
+            opened = ~accept
+            query, cell = query[opened], cell[opened]
+            child_start, child_end = self.children[level]
+            counts = child_end[cell] - child_start[cell]
+            query = np.repeat(query, counts)
+            cell = np.repeat(child_start[cell], counts) + (np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts))
+        return fx, fy
+
+
+###################################################################
+# Layout
+###################################################################
+
+
+class ForceLayout:
+    # Force-directed layout (Fruchterman-Reingold): circles push each other apart, connections pull like springs and a
+    # little gravity keeps separate components on screen. Each `step` does a bounded amount of work, a sweep over all
+    # bodies is spread over as many frames as it takes. Anchored circles, e.g. dragged ones, push and pull but don't move
+    def __init__(self, scene, center:Tuple[float, float]=(540, 360), spring_length:float=120, gravity:float=0.02,
+                 theta:float=0.8, max_batch_size:int=4096, max_step:float=60, cooling:float=0.95, min_step:float=0.5):
+        self.scene = scene
+        self.store = BaseInteractiveObject.node_store
+        self.center = center
+        self.spring_length = spring_length
+        self.gravity = gravity
+        self.theta = theta
+        self.max_batch_size = max_batch_size
+        self.seconds_per_body = 1e-5 # Measured as it goes, sizes the batches to the time budget
+        self.max_step = max_step
+        self.cooling = cooling
+        self.min_step = min_step # Stops once no body moves further than this in a sweep
+        self.running = False
+        self.temperature = max_step
+        self.sweeps = 0
+
+        self._scene_version = None
+        self.body_slots = np.empty(0, np.intp)
+        self.edge_bodies = np.empty((0, 2), np.intp)
+
+        # The sweep in progress
+        self._tree:QuadTree|None = None
+        self._x = self._y = self._fx = self._fy = np.empty(0)
+        self._next = 0
+        self._moved = 0.0
+
+    def start(self) -> None:
+        self.running = True
+        self.temperature = self.max_step
+        self._tree = None
+
+    def stop(self) -> None:
+        self.running = False
+        self._tree = None
+
+    def toggle(self) -> None:
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def is_running(self) -> bool:
+        return self.running
+
+    #---------------------------------
+    # Sweeps
+    #---------------------------------
+
+    def _collect(self) -> None:
+        # Bodies and springs only change with the scene's contents
+        if self._scene_version == self.scene.version:
+            return
+        self._scene_version = self.scene.version
+        nodes, edges = [], []
+        for obj in self.scene:
+            if isinstance(obj, Circle):
+                nodes.append(obj.unique_id)
+            elif isinstance(obj, SimpleObjectConnection):
+                edges.append((obj.obj1.unique_id, obj.obj2.unique_id))
+        self.body_slots = np.array(nodes, np.intp)
+
+        # Slots -> body index, connections to anything that isn't a circle don't take part
+        body_index = np.full(self.store.capacity, -1, np.intp)
+        body_index[self.body_slots] = np.arange(len(nodes))
+        edge_bodies = body_index[np.array(edges, np.intp).reshape(-1, 2)]
+        self.edge_bodies = edge_bodies[(edge_bodies >= 0).all(axis=1)]
+
+    def _begin_sweep(self) -> None:
+        self._collect()
+        store, slots = self.store, self.body_slots
+        anchored = (store.flags[slots] & IS_ANCHORED) != 0
+        for obj in store.objects(slots[anchored]):
+            obj.x, obj.y # Anchored positions are only refreshed when read
+        x = store.x[slots] + np.where(anchored, 0, store.offset_x[slots])
+        y = store.y[slots] + np.where(anchored, 0, store.offset_y[slots])
+
+        # Sub-pixel offsets so bodies on the same spot still have a direction to push apart in
+        x = x.astype(np.float64) + 1e-3 * np.cos(slots)
+        y = y.astype(np.float64) + 1e-3 * np.sin(slots)
+        self._x, self._y = x, y
+        self._tree = QuadTree(x, y)
+
+        # Springs (d^2 / k) and gravity for everything at once, repulsion (k^2 / d) batch by batch
+        k = self.spring_length
+        a, b = self.edge_bodies[:, 0], self.edge_bodies[:, 1]
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        pull = np.sqrt(dx*dx + dy*dy) / k
+        fx = np.bincount(a, pull * dx, minlength=len(x)) - np.bincount(b, pull * dx, minlength=len(x))
+        fy = np.bincount(a, pull * dy, minlength=len(x)) - np.bincount(b, pull * dy, minlength=len(x))
+        self._fx = fx - self.gravity * (x - self.center[0])
+        self._fy = fy - self.gravity * (y - self.center[1])
+        self._next = 0
+        self._moved = 0.0
+
+    def _step_batch(self, batch_size:int) -> None:
+        start = time.perf_counter()
+        batch = np.arange(self._next, min(self._next + batch_size, len(self.body_slots)))
+        self._next += len(batch)
+        k = self.spring_length
+        rx, ry = self._tree.repulsion(batch, self._x, self._y, self.theta, min_distance=1.0)
+        fx, fy = self._fx[batch] + k*k * rx, self._fy[batch] + k*k * ry
+
+        # Every body moves along its force, but no further than the current temperature
+        length = np.sqrt(fx*fx + fy*fy) + 1e-9
+        scale = np.minimum(length, self.temperature) / length
+        slots = self.body_slots[batch]
+        free = (self.store.flags[slots] & (IS_ANCHORED | IS_PINNED)) == 0 # Pinned bodies still push and pull the others
+        if free.any():
+            dx, dy = (fx * scale)[free], (fy * scale)[free]
+            self.store.move(slots[free], dx.astype(np.float32), dy.astype(np.float32))
+            self._moved = max(self._moved, float(np.sqrt(dx*dx + dy*dy).max()))
+        self.seconds_per_body = 0.8 * self.seconds_per_body + 0.2 * (time.perf_counter() - start) / max(len(batch), 1)
+
+    def _end_sweep(self) -> None:
+        self._tree = None
+        self.sweeps += 1
+        self.temperature *= self.cooling
+        if (self._moved < self.min_step) or (self.temperature < self.min_step):
+            self.running = False
+
+    def step(self, budget_seconds:float=0.004) -> None:
+        # Batches sized to what's left of the time budget, at least a small one per call so the layout always progresses
+        if not self.running:
+            return
+        deadline = time.perf_counter() + budget_seconds
+        while self.running:
+            if (self._tree is not None) and (self.scene.version != self._scene_version):
+                self._tree = None # Objects came or went mid-sweep, a removed body's slot may already belong to a new object
+            if self._tree is None:
+                self._begin_sweep()
+                if len(self.body_slots) < 2:
+                    self.stop()
+                    return
+            left = deadline - time.perf_counter()
+            self._step_batch(int(min(self.max_batch_size, max(64, left / self.seconds_per_body))))
+            if self._next >= len(self.body_slots):
+                self._end_sweep()
+            if time.perf_counter() >= deadline:
+                return
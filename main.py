@@ -1,178 +1,47 @@
 from __future__ import annotations
 
-import pygame
-import sys
-from world_object import Circle, ObjectSignal, BaseInteractiveObject, MouseAnchor, SimpleObjectConnection, GenericBond
-from input_management import Mouse, Keyboard
-from helpers import release_active_obj
-import cv2
-import numpy as np
-
-
-# Initialize Pygame
-pygame.init()
-window_size = (1080, 720)
-screen = pygame.display.set_mode(window_size)
-screen_depth = pygame.Surface(window_size)
-pygame.display.set_caption("Elements")
-clock = pygame.time.Clock()
-
-# Objects
-mouse = Mouse()
-keyboard = Keyboard()
-objects = [
-    Circle(screen, 200, 400, radius=50, depth=1),
-    Circle(screen, 700, 600, radius=50, depth=2),
-    # Rectangle(screen, 800, 200, width=100, height=100, depth=3, is_selectable=False),
-]
-
-active_obj:BaseInteractiveObject|None = None
-delayed_active: BaseInteractiveObject|None = None
-DELAY_SELECTABLE = pygame.USEREVENT + 1
-
-
-############################################################
-# Game loop
-############################################################
-
-
-running = True
-while running:
-
-    #---------------------------------
-    # Events
-    #---------------------------------
-
-    for event in pygame.event.get():
-        if (event.type == pygame.QUIT) or (event.type == pygame.KEYDOWN and event.key == pygame.K_q):
-            pygame.quit()
-            sys.exit()
-        if (event.type == pygame.KEYDOWN) or (event.type == pygame.KEYUP):
-            keyboard.update(event)
-        if event.type == DELAY_SELECTABLE:
-            delayed_active.is_active = True
-            pygame.time.set_timer(DELAY_SELECTABLE, 0)
-            for obj in delayed_active.get_all_objects():
-                obj.is_active = True
-            delayed_active = None
-
-    #---------------------------------
-    # Object placement
-    #---------------------------------
-
-    # User keyboard input
-    release_active_obj_for_placement = active_obj and (not active_obj.is_under_placement)
-    no_active_obj = active_obj is None
-    if keyboard.is_pressed("1") and (release_active_obj_for_placement or no_active_obj):
-        release_active_obj(active_obj)
-        active_obj = Circle(screen, 0, 0, radius=50, depth=50, anchor=mouse)
-        active_obj.is_under_placement = True
-        active_obj.is_previewing = True
-        for obj in active_obj.get_all_objects():
-            obj.is_active = False
-        objects.append(active_obj)
-
-    # Placement
-    if active_obj and active_obj.is_under_placement and mouse.left_pressed:
-        active_obj.is_under_placement = False
-        active_obj.is_previewing = False
-        active_obj.is_selected = False
-        active_obj.anchor = None
-        delayed_active = active_obj
-        active_obj = None
-        pygame.time.set_timer(DELAY_SELECTABLE, 200)
-
-    # Object deletion
-    if keyboard.is_pressed("x") and active_obj and active_obj.is_deletable:
-        active_obj.delete_all_bonds()
-        objects = [obj for obj in objects if (obj != active_obj)]
-        active_obj = None
-
-    #---------------------------------
-    # Depth
-    #---------------------------------
-
-
-    objects_flatten = set()
-    for parent_obj in objects:
-        for obj in parent_obj.get_all_objects(including_self=True):
-            objects_flatten.add(obj)
-
-    if len(objects) >= 255:
-        raise RuntimeError("Depth map only use black and white for now. Change all 3 color channels to support more objects.")
-
-    depth_sorted_objects = sorted(objects_flatten, key=lambda o: o.depth)
-    depth_colors = np.linspace(0, 255, len(depth_sorted_objects)+1).astype(int)[1:]
-
-    for depth_color, obj in zip(depth_colors, depth_sorted_objects):
-        obj.depth_color = (depth_color, depth_color, depth_color)
-        obj.draw_depth(screen_depth)
-
-    depth_map = pygame.surfarray.array3d(screen_depth)
-
-    #---------------------------------
-    # Object loop
-    #---------------------------------
-
-    for i, obj in enumerate(depth_sorted_objects):
-        if not obj.is_active:
-            continue
-
-        signal:ObjectSignal = obj.respond(mouse, keyboard, depth_map)
-
-        # Selection
-        if (active_obj is None) and signal.selected:
-            obj.is_selected = signal.selected
-            active_obj = obj
-
-        # Hover
-        if (active_obj is not None) and (obj != active_obj) and mouse.left_pressed:
-            obj.is_hovered = False
-
-        # Release object upon right click
-        if active_obj and mouse.right_pressed:
-            active_obj = release_active_obj(active_obj)
-
-        # Drag object
-        activate_drag = (obj.is_hovered and obj.is_selected and mouse.left_pressed and obj.is_movable) or obj.is_previewing
-        if isinstance(obj.anchor, MouseAnchor) and (not mouse.left_held):
-            obj.anchor = obj.old_anchor
-        if (not isinstance(obj.anchor, MouseAnchor)) and activate_drag:
-            obj.old_anchor = obj.anchor
-            obj.anchor = MouseAnchor(mouse, offset_x=obj.x - mouse.x, offset_y=obj.y - mouse.y)
-
-        # Interact with another object
-        if (not activate_drag) and (active_obj is not None) and (active_obj != obj) and signal.hovered and mouse.left_pressed and (not mouse.left_held):
-            new_interaction_obj = active_obj.interact(obj)
-            if new_interaction_obj is None:
-                continue
-            elif isinstance(new_interaction_obj, SimpleObjectConnection):
-                active_obj.add_bond("i_am_in_connection_with", new_interaction_obj, add_to_other_as_well=True)
-                obj.add_bond("i_am_in_connection_with", new_interaction_obj, add_to_other_as_well=True)
-            else:
-                print(new_interaction_obj)
-                raise NotImplementedError
-
-        # Draw
-        obj.draw()
-
-    #---------------------------------
-    # Wrap up frame
-    #---------------------------------
-
-    # Input
-    mouse.end_of_tick_update()
-    keyboard.end_of_tick_update()
-
-    # Depth map
-    screen_depth.fill((0,0,0))
-    cv2.imwrite(r"C:\Users\Jakob\Desktop\image.png", depth_map.transpose((1,0,2)))
-
-    # Screen
-    clock.tick(60)
-    pygame.display.flip()
-    screen.fill((50, 50, 50))
-
-
-pygame.quit()
-sys.exit()
+import os
+
+from world_object import Circle
+from engine import Engine
+from profiler import FrameProfiler
+from scene_io import load_scene, save_scene
+
+
+# Settings
+PICKING_MODE = "geometric" # "geometric" or "depth_buffer"
+FRAME_DUMP_DIR = None # Set to a directory, e.g. "depth_dumps", to dump the pick buffer to disk
+FRAME_DUMP_EVERY_N_FRAMES = 30
+RENDER_MODE = "dirty_rects" # "dirty_rects" or "full"
+BATCH_EDGES = True # Draw connections through a cached `EdgeLayer` instead of one by one
+LEVEL_OF_DETAIL = True # Drop labels and outlines when zoomed out, and draw nodes as points when far out
+PROFILE = False # Time the loop phases and every `respond`/`draw`/`draw_depth`, "p" toggles the overlay either way
+PROFILE_TRACE = None # Set to a file, e.g. "profile.csv" or "profile.jsonl", to write the timings of every frame
+UPDATE_RATE = 120 # Input and simulation steps per second, independent of how fast frames are drawn
+MAX_FPS = 60
+IMPORT_FILE = None # Set to a CSV edge list or GraphML file, e.g. "graph.csv", to stream it in while the window is already up
+SCENE_FILE = None # Set to a file, e.g. "scene.npz" or "scene.json", to load the scene from on start and save it to on quit
+IDLE_MODE = True # Stop drawing while nothing changes and sleep until the next event
+KEY_BINDINGS = None # E.g. {"delete": "ctrl+x"}, overrides single actions of `engine.DEFAULT_KEY_BINDINGS`
+
+
+profiler = FrameProfiler(enabled=PROFILE)
+if PROFILE_TRACE:
+    profiler.open_trace(PROFILE_TRACE)
+
+engine = Engine(window_size=(1080, 720), picking_mode=PICKING_MODE, render_mode=RENDER_MODE, batch_edges=BATCH_EDGES, level_of_detail=LEVEL_OF_DETAIL,
+                update_rate=UPDATE_RATE, max_fps=MAX_FPS, frame_dump_dir=FRAME_DUMP_DIR,
+                frame_dump_every_n_frames=FRAME_DUMP_EVERY_N_FRAMES, profiler=profiler, idle_mode=IDLE_MODE,
+                key_bindings=KEY_BINDINGS)
+if SCENE_FILE and os.path.exists(SCENE_FILE):
+    load_scene(engine.scene, engine.screen, SCENE_FILE)
+else:
+    engine.scene.add(Circle(engine.screen, 200, 400, radius=50, depth=1))
+    engine.scene.add(Circle(engine.screen, 700, 600, radius=50, depth=2))
+if IMPORT_FILE:
+    engine.start_import(IMPORT_FILE)
+# engine.scene.add(Rectangle(engine.screen, 800, 200, width=100, height=100, depth=3, is_selectable=False))
+
+engine.run()
+if SCENE_FILE:
+    save_scene(engine.scene, SCENE_FILE)
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import math
+import weakref
+from typing import Dict, List, Set
+
+import numpy as np
+import pygame
+
+
+###################################################################
+# State flags - one bit each in `NodeStore.flags`
+###################################################################
+
+
+IS_SELECTED = 1 << 0
+IS_HOVERED = 1 << 1
+IS_ACTIVE = 1 << 2
+IS_SELECTABLE = 1 << 3
+IS_MOVABLE = 1 << 4
+IS_PREVIEWING = 1 << 5
+IS_UNDER_PLACEMENT = 1 << 6
+IS_DELETABLE = 1 << 7
+IS_ANCHORED = 1 << 8 # Position follows `anchor`, so the stored x/y is only refreshed when read
+IS_DIRTY = 1 << 9 # Something this object's position or geometry is derived from has changed
+IS_UNTRACKED = 1 << 10 # Anchored to something that can't report its moves, e.g. the mouse, so the position is re-read every update
+IS_MOVED = 1 << 11 # Position or geometry changed since the scene's spatial index last looked
+IS_RESTYLED = 1 << 12 # Looks different, e.g. hovered or selected or another depth, since the scene's last `sync_index`
+IS_PINNED = 1 << 13 # Held in place by the user, e.g. a dragged group, automatic layouts leave it alone
+
+
+###################################################################
+# Store
+###################################################################
+
+
+class NodeStore:
+    float_fields = ("x", "y", "offset_x", "offset_y", "radius", "depth")
+
+    def __init__(self, capacity:int=64):
+        # One row per slot, objects use their `unique_id` as slot so rows are reused as IDs get recycled.
+        # The arrays are reallocated when the store grows, so don't hold on to them across `add` calls
+        self.capacity = 0
+        self.x = self.y = self.offset_x = self.offset_y = self.radius = self.depth = np.empty(0, np.float32)
+        self.flags = np.empty(0, np.uint16)
+        self.alive = np.empty(0, bool)
+        self._objects:List[weakref.ref|None] = []
+        self._grow(capacity)
+
+        # slot -> slots derived from it (anchored objects, connections) and the reverse
+        self.dependents:Dict[int, Set[int]] = {}
+        self.depends_on:Dict[int, Set[int]] = {}
+
+        # How often derived geometry was recomputed vs. reused, `last_tick` holds the previous frame's numbers
+        self.recomputed = 0
+        self.reused = 0
+        self.last_tick = {"recomputed": 0, "reused": 0}
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _grow(self, capacity:int) -> None:
+        old = self.capacity
+        for name in self.float_fields:
+            column = np.zeros(capacity, np.float32)
+            column[:old] = getattr(self, name)
+            setattr(self, name, column)
+        flags = np.zeros(capacity, np.uint16)
+        flags[:old] = self.flags
+        alive = np.zeros(capacity, bool)
+        alive[:old] = self.alive
+        self.flags, self.alive = flags, alive
+        self._objects.extend([None] * (capacity - old))
+        self.capacity = capacity
+
+    def add(self, slot:int, obj) -> None:
+        if slot >= self.capacity:
+            self._grow(max(2 * self.capacity, slot + 1))
+        assert not self.alive[slot], f"Slot {slot} is already in use"
+        self.alive[slot] = True
+        self._objects[slot] = weakref.ref(obj) # Weak, the store must not keep deleted objects alive
+
+    def add_many(self, slots:List[int], objs:List) -> None:
+        if slots and (max(slots) >= self.capacity):
+            self._grow(max(2 * self.capacity, max(slots) + 1))
+        assert not self.alive[slots].any(), "Some of the slots are already in use"
+        self.alive[slots] = True
+        for slot, obj in zip(slots, objs):
+            self._objects[slot] = weakref.ref(obj)
+
+    def release(self, slot:int) -> None:
+        for other in self.dependents.pop(slot, ()):
+            self.depends_on[other].discard(slot)
+        for other in self.depends_on.pop(slot, ()):
+            self.dependents[other].discard(slot)
+        for name in self.float_fields:
+            getattr(self, name)[slot] = 0
+        self.flags[slot] = 0
+        self.alive[slot] = False
+        self._objects[slot] = None
+
+    #---------------------------------
+    # Bulk access
+    #---------------------------------
+
+    def get(self, slot:int):
+        ref = self._objects[slot]
+        return None if ref is None else ref()
+
+    def objects(self, slots:np.ndarray) -> List:
+        return [obj for obj in map(self.get, slots.tolist()) if obj is not None]
+
+    def slots(self, with_flags:int=0, without_flags:int=0, any_flags:int=0) -> np.ndarray:
+        mask = self.alive & ((self.flags & with_flags) == with_flags) & ((self.flags & without_flags) == 0)
+        if any_flags:
+            mask &= (self.flags & any_flags) != 0
+        return np.flatnonzero(mask)
+
+    def move(self, slots:np.ndarray, dx, dy) -> None:
+        # Anchored objects follow their anchor, so only the free ones are moved. `dx`/`dy` are scalars or one per slot
+        free = (self.flags[slots] & IS_ANCHORED) == 0
+        slots = slots[free]
+        if np.ndim(dx):
+            dx, dy = dx[free], dy[free]
+        self.x[slots] += dx
+        self.y[slots] += dy
+        self.flags[slots] |= IS_MOVED
+        for slot in slots.tolist():
+            if slot in self.dependents:
+                self.invalidate(slot)
+
+    #---------------------------------
+    # Invalidation
+    #---------------------------------
+
+    def depend(self, slot:int, on_slot:int) -> None:
+        self.dependents.setdefault(on_slot, set()).add(slot)
+        self.depends_on.setdefault(slot, set()).add(on_slot)
+        self.flags[slot] |= IS_DIRTY | IS_MOVED
+        self.invalidate(slot)
+
+    def depend_many(self, slots:List[int], on_slots:List[int]) -> None:
+        # `depend` pairwise, for freshly built objects that have no dependents of their own yet
+        dependents, depends_on = self.dependents, self.depends_on
+        for slot, on_slot in zip(slots, on_slots):
+            dependents.setdefault(on_slot, set()).add(slot)
+            depends_on.setdefault(slot, set()).add(on_slot)
+        self.flags[slots] |= IS_DIRTY | IS_MOVED
+        for slot in slots:
+            if slot in dependents:
+                self.invalidate(slot)
+
+    def undepend(self, slot:int, on_slot:int) -> None:
+        self.dependents.get(on_slot, set()).discard(slot)
+        self.depends_on.get(slot, set()).discard(on_slot)
+
+    def invalidate(self, slot:int) -> None:
+        # Marks everything derived from `slot` dirty. An object that's already dirty has dirty dependents as well
+        stack = list(self.dependents.get(slot, ()))
+        while stack:
+            other = stack.pop()
+            if self.flags[other] & IS_DIRTY:
+                continue
+            self.flags[other] |= IS_DIRTY | IS_MOVED
+            stack.extend(self.dependents.get(other, ()))
+
+    def end_of_tick_update(self) -> None:
+        self.last_tick = {"recomputed": self.recomputed, "reused": self.reused}
+        self.recomputed = 0
+        self.reused = 0
+
+    #---------------------------------
+    # Vectorized queries
+    #---------------------------------
+
+    def slots_in_rect(self, rect:pygame.Rect) -> np.ndarray:
+        # Objects without a position (NaN, e.g. connections) never match
+        inside = (self.x >= rect.left) & (self.x < rect.right) & (self.y >= rect.top) & (self.y < rect.bottom)
+        return np.flatnonzero(self.alive & inside)
+
+    def circles_at(self, x, y) -> np.ndarray:
+        # Slots with a radius whose disc contains (x, y), topmost first
+        hit = self.alive & (self.radius > 0) & ((self.x - x)**2 + (self.y - y)**2 <= self.radius**2)
+        slots = np.flatnonzero(hit)
+        return slots[np.argsort(-self.depth[slots], kind="stable")]
+
+
+###################################################################
+# Descriptors - let objects read and write their row like plain attributes
+###################################################################
+
+
+class StoreField:
+    def __init__(self, invalidates:bool=False):
+        # `invalidates` fields take part in derived geometry, so changing them dirties the dependents
+        self.invalidates = invalidates
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return float(getattr(obj.node_store, self.name)[obj.unique_id])
+
+    def __set__(self, obj, value):
+        store, slot = obj.node_store, obj.unique_id
+        column = getattr(store, self.name)
+        if self.invalidates and (column[slot] != value):
+            store.flags[slot] |= IS_DIRTY | IS_MOVED
+            store.invalidate(slot)
+        column[slot] = value
+
+
+class StoreFlag:
+    def __init__(self, bit:int, restyles:bool=False):
+        # `restyles` flags change how the object is drawn, so changing them marks it for redrawing
+        self.bit = bit
+        self.restyles = restyles
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return bool(obj.node_store.flags[obj.unique_id] & self.bit)
+
+    def __set__(self, obj, value):
+        flags, slot = obj.node_store.flags, obj.unique_id
+        old = flags[slot]
+        new = (old | self.bit) if value else (old & ~np.uint16(self.bit))
+        if self.restyles and (new != old):
+            new |= IS_RESTYLED
+        flags[slot] = new
+
+
+def position_or_none(value) -> float|None:
+    # Objects placed at `None`, e.g. connections, are stored as NaN
+    value = float(value)
+    return None if math.isnan(value) else value
@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import pygame
+
+from registry import IdAllocator
+from world_object import BaseInteractiveObject
+
+
+###################################################################
+# Spatial index
+###################################################################
+
+
+class SpatialGrid:
+    def __init__(self, cell_size:int=64):
+        self.cell_size = cell_size
+        self.cells:Dict[Tuple[int, int], Set] = defaultdict(set)
+        self.object_cells:Dict[object, Tuple[int, int, int, int]] = {}
+
+    def __len__(self):
+        return len(self.object_cells)
+
+    def __contains__(self, obj):
+        return obj in self.object_cells
+
+    def _cell_range(self, rect:pygame.Rect) -> Tuple[int, int, int, int]:
+        c = self.cell_size
+        return rect.left // c, rect.top // c, (rect.right - 1) // c, (rect.bottom - 1) // c
+
+    def update(self, obj, rect:pygame.Rect) -> None:
+        # Objects only change cells when their bounds cross a cell border, which is rare while dragging
+        new_range = self._cell_range(rect)
+        old_range = self.object_cells.get(obj)
+        if old_range == new_range:
+            return
+        if old_range is not None:
+            self.remove(obj)
+
+        cx0, cy0, cx1, cy1 = new_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.cells[(cx, cy)].add(obj)
+        self.object_cells[obj] = new_range
+
+    def remove(self, obj) -> None:
+        cell_range = self.object_cells.pop(obj, None)
+        if cell_range is None:
+            return
+
+        cx0, cy0, cx1, cy1 = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells[(cx, cy)]
+                cell.discard(obj)
+                if not cell:
+                    del self.cells[(cx, cy)]
+
+    def query_point(self, x, y) -> Set:
+        c = self.cell_size
+        return self.cells.get((int(x) // c, int(y) // c), set())
+
+    def query_rect(self, rect:pygame.Rect) -> Set:
+        cx0, cy0, cx1, cy1 = self._cell_range(rect)
+        found = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found |= cell
+        return found
+
+
+class MultiLevelGrid:
+    # Like `SpatialGrid`, but an object sits in a single cell however large it is: on the finest level whose cells are
+    # at least as large as the object, in the cell holding its top left corner. Level `l` has cells of `cell_size << l`.
+    # Long connections across a large graph cost as little as small nodes, at the price of a query looking one cell
+    # further up and left on every level
+    def __init__(self, cell_size:int=64, max_level:int=24):
+        self.cell_size = cell_size
+        self.max_level = max_level # Objects larger than `cell_size << max_level` aren't found reliably
+        self.levels:List[Dict[Tuple[int, int], Set]] = [defaultdict(set) for _ in range(max_level + 1)]
+        self.object_cells:Dict[object, Tuple[int, int, int]] = {}
+        self.bounds:Dict[object, pygame.Rect] = {}
+
+    def __len__(self):
+        return len(self.object_cells)
+
+    def __contains__(self, obj):
+        return obj in self.object_cells
+
+    def _cell(self, rect:pygame.Rect) -> Tuple[int, int, int]:
+        size = max(rect.width, rect.height, 1)
+        level = min(self.max_level, max(0, math.ceil(math.log2(size / self.cell_size))))
+        c = self.cell_size << level
+        return level, rect.left // c, rect.top // c
+
+    def update(self, obj, rect:pygame.Rect) -> None:
+        self.bounds[obj] = rect
+        cell = self._cell(rect)
+        old_cell = self.object_cells.get(obj)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._remove_from_cell(obj, old_cell)
+        level, cx, cy = cell
+        self.levels[level][(cx, cy)].add(obj)
+        self.object_cells[obj] = cell
+
+    def _remove_from_cell(self, obj, cell:Tuple[int, int, int]) -> None:
+        level, cx, cy = cell
+        objs = self.levels[level][(cx, cy)]
+        objs.discard(obj)
+        if not objs:
+            del self.levels[level][(cx, cy)]
+
+    def remove(self, obj) -> None:
+        cell = self.object_cells.pop(obj, None)
+        if cell is None:
+            return
+        self._remove_from_cell(obj, cell)
+        del self.bounds[obj]
+
+    def query_rect(self, rect:pygame.Rect) -> Set:
+        # Everything whose bounds may overlap `rect`, callers check `bounds` for the exact answer
+        found = set()
+        for level, cells in enumerate(self.levels):
+            if not cells:
+                continue
+            c = self.cell_size << level
+            cx0, cy0, cx1, cy1 = rect.left // c - 1, rect.top // c - 1, (rect.right - 1) // c, (rect.bottom - 1) // c
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= len(cells):
+                for cx in range(cx0, cx1 + 1):
+                    for cy in range(cy0, cy1 + 1):
+                        objs = cells.get((cx, cy))
+                        if objs:
+                            found |= objs
+            else: # Zoomed far out, fewer cells in use than in the range
+                for (cx, cy), objs in cells.items():
+                    if (cx0 <= cx <= cx1) and (cy0 <= cy <= cy1):
+                        found |= objs
+        return found
+
+    def query_point(self, x, y) -> Set:
+        return self.query_rect(pygame.Rect(int(x // 1), int(y // 1), 1, 1))
+
+    def total_bounds(self) -> pygame.Rect|None:
+        if not self.bounds:
+            return None
+        bounds = list(self.bounds.values())
+        return bounds[0].unionall(bounds[1:])
+
+
+###################################################################
+# Damage
+###################################################################
+
+
+def merge_rects(rects:List[pygame.Rect], bounds:pygame.Rect, max_rects:int=256) -> List[pygame.Rect]:
+    # Clipped to `bounds`, overlapping rects merged into one. Past `max_rects` merging would cost more than it saves,
+    # so that's all of `bounds`
+    if len(rects) > max_rects:
+        return [bounds]
+    merged:List[pygame.Rect] = []
+    for rect in rects:
+        rect = rect.clip(bounds)
+        if not rect.width or not rect.height:
+            continue
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+###################################################################
+# Pickers
+###################################################################
+
+
+class GeometricPicker:
+    # Picks in world coordinates. Given an `index` that's kept up to date elsewhere, e.g. `Scene.index`, it queries
+    # that one and has nothing to sync itself
+    def __init__(self, cell_size:int=64, index:SpatialGrid|MultiLevelGrid|None=None):
+        self.owns_grid = index is None
+        self.grid = SpatialGrid(cell_size) if self.owns_grid else index
+
+    @property
+    def needs_sync(self) -> bool:
+        # Whether `sync` has to be handed the visible objects every update
+        return self.owns_grid
+
+    def sync(self, objects:Iterable) -> None:
+        # Removed objects are dropped through `remove`, e.g. by being a `Scene` listener
+        if not self.owns_grid:
+            return
+        for obj in objects:
+            self.grid.update(obj, obj.get_bounds())
+
+    def remove(self, obj) -> None:
+        if self.owns_grid:
+            self.grid.remove(obj)
+
+    def _candidates(self, x, y) -> List:
+        # A `MultiLevelGrid` cell on a coarse level holds every long connection starting near it, the bounds it keeps
+        # rule most of them out before the exact test
+        candidates = self.grid.query_point(x, y)
+        bounds = getattr(self.grid, "bounds", None)
+        if bounds is None:
+            return list(candidates)
+        return [obj for obj in candidates if bounds[obj].collidepoint(x, y)]
+
+    def pick_all(self, x, y) -> List:
+        return [obj for obj in self._candidates(x, y) if obj.contains_point(x, y)]
+
+    def pick(self, x, y):
+        # Topmost hit wins, same as the last object drawn at that pixel. Tried from the top down, so the exact test
+        # usually runs on a few candidates only
+        candidates = self._candidates(x, y)
+        if not candidates:
+            return None
+        slots = np.fromiter((obj.unique_id for obj in candidates), np.intp, len(candidates))
+        for i in np.argsort(-BaseInteractiveObject.node_store.depth[slots], kind="stable").tolist():
+            if candidates[i].contains_point(x, y):
+                return candidates[i]
+        return None
+
+
+class DepthBufferPicker:
+    # Fixed channel layout so a pixel read through `pixels2d` is the packed object ID itself.
+    # The buffer is in screen space, it's given the visible objects and picks world positions through the camera
+    masks = (0xFF0000, 0x00FF00, 0x0000FF, 0)
+    max_objects = 0xFFFFFF # 0 is the background
+    needs_sync = True # Repaints from the visible objects
+    max_damage_rects = 64 # Damage past this many rects, or past `max_damage_fraction` of the buffer, repaints it as a whole
+    max_damage_fraction = 0.5
+
+    def __init__(self, size, cell_size:int=64):
+        self.surface = pygame.Surface(size, 0, 32, self.masks)
+        self.surface.fill(0)
+        self.pixels = pygame.surfarray.pixels2d(self.surface) # Zero-copy uint32 view, stays valid across frames
+        self.grid = SpatialGrid(cell_size)
+        self.camera = BaseInteractiveObject.camera
+        self._camera_version = self.camera.version
+        self._repaint_all = True # Every visible object's bounds are out of date, e.g. the first sync or after a camera move
+
+        self.painted:Dict[object, pygame.Rect] = {} # Screen bounds as last painted
+        self.visible:Dict[object, None] = {}
+        self._visible_list:List = [] # What `visible` was built from
+        self.pending:Dict[object, None] = {} # Reported by the scene since the last sync, see `changed`
+        self.pick_ids:Dict[object, int] = {}
+        self.objects_by_pick_id:Dict[int, object] = {}
+        self.pick_id_allocator = IdAllocator(first_id=1, max_id=self.max_objects)
+        self.damaged:List[pygame.Rect] = []
+
+    @staticmethod
+    def pick_id_to_color(pick_id:int) -> Tuple[int, int, int]:
+        return (pick_id >> 16) & 0xFF, (pick_id >> 8) & 0xFF, pick_id & 0xFF
+
+    def _paint_key(self, obj):
+        return obj.depth, self.pick_ids[obj]
+
+    def _add(self, obj) -> None:
+        pick_id = self.pick_id_allocator.allocate()
+        obj.depth_color = self.pick_id_to_color(pick_id)
+        self.pick_ids[obj] = pick_id
+        self.objects_by_pick_id[pick_id] = obj
+
+    def _unpaint(self, obj) -> None:
+        painted = self.painted.pop(obj, None)
+        if painted is not None:
+            self.damaged.append(painted)
+            self.grid.remove(obj)
+
+    def changed(self, objs:List) -> None:
+        # `Scene` listener, objects that were added, moved or restyled
+        self.pending.update(dict.fromkeys(objs))
+
+    def remove(self, obj) -> None:
+        self.pending.pop(obj, None)
+        self.visible.pop(obj, None)
+        self._unpaint(obj)
+        pick_id = self.pick_ids.pop(obj, None)
+        if pick_id is None:
+            return
+        del self.objects_by_pick_id[pick_id]
+        self.pick_id_allocator.release(pick_id)
+
+    def sync(self, objects:Iterable) -> None:
+        # Only objects the scene reported as changed (through `changed`, as a `Scene` listener) and objects that came into
+        # or went out of view damage the buffer, a static scene costs nothing here. A camera move changes everything
+        objects = list(objects)
+        if objects != self._visible_list:
+            self._visible_list = objects
+            self.visible = dict.fromkeys(objects)
+            for obj in [obj for obj in self.painted if obj not in self.visible]:
+                self._unpaint(obj)
+            for obj in objects:
+                if obj not in self.pick_ids:
+                    self._add(obj)
+            self.pending.update(dict.fromkeys(obj for obj in objects if obj not in self.painted))
+
+        pending, self.pending = self.pending, {}
+        if self.camera.version != self._camera_version:
+            self._camera_version = self.camera.version
+            self._repaint_all = True
+        if self._repaint_all:
+            self._repaint_all = False
+            self.damaged = [self.surface.get_rect()]
+            pending = self.visible
+        for obj in pending:
+            if obj not in self.visible:
+                continue
+            rect = obj.get_draw_bounds()
+            painted = self.painted.get(obj)
+            if painted is not None:
+                self.damaged.append(painted)
+            self.damaged.append(rect)
+            self.painted[obj] = rect
+            self.grid.update(obj, rect)
+        self.repaint()
+
+    def repaint(self) -> None:
+        # Damage is merged first, so overlapping objects are painted once. Past the limits it's one repaint of everything
+        screen_rect = self.surface.get_rect()
+        rects = merge_rects(self.damaged, screen_rect, self.max_damage_rects)
+        if sum(rect.width * rect.height for rect in rects) > self.max_damage_fraction * screen_rect.width * screen_rect.height:
+            rects = [screen_rect]
+        for rect in rects:
+            self.surface.set_clip(rect)
+            self.surface.fill(0)
+            overlapping = [obj for obj in self.grid.query_rect(rect) if self.painted[obj].colliderect(rect)]
+            for obj in sorted(overlapping, key=self._paint_key):
+                obj.draw_depth(self.surface)
+        self.surface.set_clip(None)
+        self.damaged = []
+
+    def pick(self, x, y):
+        x, y = self.camera.world_to_screen(x, y)
+        x, y = round(x), round(y)
+        if not self.surface.get_rect().collidepoint(x, y):
+            return None
+        return self.objects_by_pick_id.get(int(self.pixels[x, y]))
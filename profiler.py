@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import csv
+import functools
+import json
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pygame
+
+from fonts import get_font
+
+
+###################################################################
+# Spans
+###################################################################
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler:FrameProfiler, name:str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+###################################################################
+# Profiler
+###################################################################
+
+
+class FrameProfiler:
+    # Per-frame totals and call counts for every timer, with rolling percentiles over the last `window` frames. Counters,
+    # e.g. how much cached geometry was reused, are summed per frame the same way.
+    # Disabled it hands out a shared no-op span and the instrumented methods are the untouched originals
+    default_methods = ("respond", "draw", "draw_depth")
+    overlay_font = None
+
+    def __init__(self, window:int=300, enabled:bool=False):
+        self.window = window
+        self.enabled = False
+        self.show_overlay = False
+        self.frame_index = 0
+        self.totals:Dict[str, Deque[float]] = {}
+        self.calls:Dict[str, Deque[int]] = {}
+        self._frame_totals:Dict[str, float] = defaultdict(float)
+        self._frame_calls:Dict[str, int] = defaultdict(int)
+        self.counters:Dict[str, Deque[int]] = {}
+        self._frame_counters:Dict[str, int] = defaultdict(int)
+
+        self._classes:List[Tuple[type, Tuple[str, ...]]] = []
+        self._originals:List[Tuple[type, str, object]] = []
+        self._trace_file = None
+        self._trace_writer = None
+        self._overlay_rect:pygame.Rect|None = None
+        self._lap_start = time.perf_counter()
+        if enabled:
+            self.enable()
+
+    #---------------------------------
+    # Switching on and off
+    #---------------------------------
+
+    def instrument(self, classes:Iterable[type], methods:Iterable[str]=default_methods) -> None:
+        # Only methods a class defines itself are wrapped, inherited ones are timed under the class that defines them
+        self._classes += [(cls, tuple(methods)) for cls in classes]
+        if self.enabled:
+            self._wrap_methods()
+
+    def _wrap_methods(self) -> None:
+        for cls, methods in self._classes:
+            for method in methods:
+                original = vars(cls).get(method)
+                if original is None or any((c is cls) and (m == method) for c, m, _ in self._originals):
+                    continue
+                setattr(cls, method, self._timed_method(original, f"{cls.__name__}.{method}"))
+                self._originals.append((cls, method, original))
+
+    def _timed_method(self, original, name:str):
+        record = self.record
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return timed
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        self._lap_start = time.perf_counter()
+        self._wrap_methods()
+
+    def disable(self) -> None:
+        self.enabled = False
+        for cls, method, original in reversed(self._originals):
+            setattr(cls, method, original)
+        self._originals = []
+        self._frame_totals.clear()
+        self._frame_calls.clear()
+        self._frame_counters.clear()
+
+    def toggle_overlay(self) -> None:
+        # Showing the overlay turns profiling on, hiding it leaves profiling as it is
+        self.show_overlay = not self.show_overlay
+        if self.show_overlay:
+            self.enable()
+
+    #---------------------------------
+    # Recording
+    #---------------------------------
+
+    def phase(self, name:str):
+        # with profiler.phase("draw"): ...
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def lap(self, name:str) -> None:
+        # Books the time since the previous `lap` (or the end of the last frame) under `name`, for straight-line loops
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.record(name, now - self._lap_start)
+        self._lap_start = now
+
+    def record(self, name:str, seconds:float) -> None:
+        self._frame_totals[name] += seconds
+        self._frame_calls[name] += 1
+
+    def count(self, name:str, n:int=1) -> None:
+        if self.enabled:
+            self._frame_counters[name] += n
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        for name in set(self.totals) | set(self._frame_totals):
+            if name not in self.totals:
+                self.totals[name] = deque(maxlen=self.window)
+                self.calls[name] = deque(maxlen=self.window)
+            self.totals[name].append(self._frame_totals.get(name, 0.0))
+            self.calls[name].append(self._frame_calls.get(name, 0))
+        for name in set(self.counters) | set(self._frame_counters):
+            if name not in self.counters:
+                self.counters[name] = deque(maxlen=self.window)
+            self.counters[name].append(self._frame_counters.get(name, 0))
+        if self._trace_writer is not None:
+            self._write_trace()
+        self._frame_totals.clear()
+        self._frame_calls.clear()
+        self._frame_counters.clear()
+        self.frame_index += 1
+        self._lap_start = time.perf_counter()
+
+    def stats(self) -> Dict[str, dict]:
+        stats = {}
+        for name, totals in self.totals.items():
+            ms = np.asarray(totals) * 1000
+            p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+            stats[name] = {"calls_per_frame": float(np.mean(self.calls[name])), "mean_ms": float(ms.mean()),
+                           "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+        return stats
+
+    def counter_stats(self) -> Dict[str, dict]:
+        stats = {}
+        for name, values in self.counters.items():
+            values = np.asarray(values)
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            stats[name] = {"mean": float(values.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        return stats
+
+    #---------------------------------
+    # Trace file
+    #---------------------------------
+
+    def open_trace(self, path:str) -> None:
+        # One row per timer and frame. `.csv` is written as CSV, anything else as JSON lines
+        self.close_trace()
+        self._trace_file = open(path, "w", newline="")
+        if path.endswith(".csv"):
+            writer = csv.writer(self._trace_file)
+            writer.writerow(["frame", "name", "calls", "total_ms"])
+            self._trace_writer = lambda frame, name, calls, total_ms: writer.writerow([frame, name, calls, f"{total_ms:.4f}"])
+        else:
+            write = self._trace_file.write
+            self._trace_writer = lambda frame, name, calls, total_ms: write(json.dumps({"frame": frame, "name": name, "calls": calls, "total_ms": round(total_ms, 4)}) + "\n")
+
+    def _write_trace(self) -> None:
+        # Counters go in as a count with no time
+        for name, seconds in self._frame_totals.items():
+            self._trace_writer(self.frame_index, name, self._frame_calls[name], seconds * 1000)
+        for name, n in self._frame_counters.items():
+            self._trace_writer(self.frame_index, name, n, 0.0)
+
+    def close_trace(self) -> None:
+        if self._trace_file is not None:
+            self._trace_file.close()
+        self._trace_file = None
+        self._trace_writer = None
+
+    #---------------------------------
+    # Overlay
+    #---------------------------------
+
+    def overlay_damage(self) -> List[pygame.Rect]:
+        # For dirty-rect rendering, both where the overlay was and where it's about to be have to be redrawn
+        rects = [] if (self._overlay_rect is None) else [self._overlay_rect]
+        if self.show_overlay:
+            rects.append(self._overlay_bounds())
+        return rects
+
+    def _overlay_bounds(self, font_size:int=16, width:int=430) -> pygame.Rect:
+        line_height = get_font(self.overlay_font, font_size).get_linesize()
+        return pygame.Rect(8, 8, width, line_height * (len(self.totals) + len(self.counters) + 1) + 8)
+
+    def draw_overlay(self, screen:pygame.Surface, font_size:int=16) -> None:
+        if not self.show_overlay:
+            self._overlay_rect = None
+            return
+
+        # Rendered straight from the font, these strings change every frame and would only churn the label cache
+        font = get_font(self.overlay_font, font_size)
+        bounds = self._overlay_bounds(font_size)
+        panel = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        columns = (("timer", 0), ("calls", 250), ("p50", 310), ("p95", 365), ("p99", 420)) # Right edges of the number columns
+        rows = [[title for title, _ in columns]]
+        for name, s in sorted(self.stats().items(), key=lambda item: -item[1]["p50_ms"]):
+            rows.append([name, f"{s['calls_per_frame']:.0f}", f"{s['p50_ms']:.2f}", f"{s['p95_ms']:.2f}", f"{s['p99_ms']:.2f}"])
+        for name, s in sorted(self.counter_stats().items()): # Counts per frame, no time
+            rows.append([name, "", f"{s['p50']:.0f}", f"{s['p95']:.0f}", f"{s['p99']:.0f}"])
+        for i, row in enumerate(rows):
+            y = 4 + i * font.get_linesize()
+            for text, (_, right) in zip(row, columns):
+                rendered = font.render(text, True, (230, 230, 230))
+                panel.blit(rendered, (4 if (right == 0) else (right - rendered.get_width()), y))
+        screen.blit(panel, bounds)
+        self._overlay_rect = bounds
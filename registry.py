@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import weakref
+from typing import Iterator, List
+
+
+###################################################################
+# IDs
+###################################################################
+
+
+class IdAllocator:
+    def __init__(self, first_id:int=0, max_id:int|None=None):
+        self.first_id = first_id
+        self.max_id = max_id
+        self.next_id = first_id
+        self.free_ids:List[int] = []
+        self._free_id_set = set()
+
+    def __len__(self):
+        # Number of IDs currently handed out
+        return (self.next_id - self.first_id) - len(self.free_ids)
+
+    def allocate(self) -> int:
+        # Recycled IDs first (LIFO), so the ID space stays as compact as the number of live objects
+        if self.free_ids:
+            unique_id = self.free_ids.pop()
+            self._free_id_set.discard(unique_id)
+            return unique_id
+        if (self.max_id is not None) and (self.next_id > self.max_id):
+            raise RuntimeError(f"Ran out of IDs, at most {self.max_id - self.first_id + 1} can be in use at once")
+        unique_id = self.next_id
+        self.next_id += 1
+        return unique_id
+
+    def allocate_many(self, n:int) -> List[int]:
+        # Same IDs as `n` calls to `allocate`, in the same order
+        recycled = self.free_ids[-n:][::-1] if n else []
+        del self.free_ids[len(self.free_ids) - len(recycled):]
+        self._free_id_set.difference_update(recycled)
+        fresh = n - len(recycled)
+        if (self.max_id is not None) and (self.next_id + fresh - 1 > self.max_id):
+            raise RuntimeError(f"Ran out of IDs, at most {self.max_id - self.first_id + 1} can be in use at once")
+        ids = recycled + list(range(self.next_id, self.next_id + fresh))
+        self.next_id += fresh
+        return ids
+
+    def release(self, unique_id:int) -> None:
+        assert self.first_id <= unique_id < self.next_id, f"ID {unique_id} was never allocated"
+        assert unique_id not in self._free_id_set, f"ID {unique_id} was released twice"
+        self.free_ids.append(unique_id)
+        self._free_id_set.add(unique_id)
+
+
+def short_label(index:int) -> str:
+    # 0 -> "A", 25 -> "Z", 26 -> "AA", ... like spreadsheet columns
+    label = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        label = chr(ord("A") + remainder) + label
+    return label
+
+
+###################################################################
+# Object registry
+###################################################################
+
+
+class ObjectRegistry:
+    def __init__(self):
+        self._objects = weakref.WeakValueDictionary() # Entries vanish on their own once an object is garbage collected
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._objects.values()))
+
+    def __contains__(self, unique_id:int):
+        return unique_id in self._objects
+
+    def register(self, obj) -> None:
+        self._objects[obj.unique_id] = obj
+
+    def register_many(self, objs:List) -> None:
+        self._objects.update((obj.unique_id, obj) for obj in objs)
+
+    def unregister(self, obj) -> None:
+        # The ID may already belong to a newer object if it got recycled
+        if self._objects.get(obj.unique_id) is obj:
+            del self._objects[obj.unique_id]
+
+    def get(self, unique_id:int):
+        return self._objects.get(unique_id)
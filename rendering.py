@@ -0,0 +1,488 @@
+from __future__ import annotations
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pygame
+
+from helpers import DEFAULT_COLORS
+from node_store import IS_ACTIVE, IS_ANCHORED, IS_HOVERED, IS_PREVIEWING, IS_SELECTED
+from picking import SpatialGrid, merge_rects
+from world_object import BaseInteractiveObject, Circle, SimpleObjectConnection, TextRectangle
+
+
+BACKGROUND_COLOR = (50, 50, 50)
+LOD_FULL = "full"
+LOD_SIMPLE = "simple"
+LOD_POINTS = "points"
+
+
+###################################################################
+# Edge layer
+###################################################################
+
+
+def split_edges(objects:Sequence) -> Tuple[List[SimpleObjectConnection], List]:
+    edges, others = [], []
+    for obj in objects:
+        (edges if isinstance(obj, SimpleObjectConnection) else others).append(obj)
+    return edges, others
+
+
+def refresh_anchored(slots:np.ndarray) -> None:
+    # Anchored objects only store their position once it's read
+    store = BaseInteractiveObject.node_store
+    for obj in store.objects(slots[(store.flags[slots] & IS_ANCHORED) != 0]):
+        obj.x
+
+
+def screen_endpoints(node1_slots:np.ndarray, node2_slots:np.ndarray) -> np.ndarray:
+    # (x1, y1, x2, y2) on screen for every edge at once, same geometry as `Circle.get_connection_anchor`.
+    # Nodes without a radius are hit in the center
+    store, camera = BaseInteractiveObject.node_store, BaseInteractiveObject.camera
+    refresh_anchored(np.unique(np.concatenate((node1_slots, node2_slots))))
+    x1, y1 = store.x[node1_slots], store.y[node1_slots]
+    x2, y2 = store.x[node2_slots], store.y[node2_slots]
+    dx, dy = x2 - x1, y2 - y1
+    d = np.sqrt(dx*dx + dy*dy) + 1e-6
+    r1, r2 = store.radius[node1_slots], store.radius[node2_slots]
+    f1 = np.where(r1 > 0, (r1 + 5) / d, 0)
+    f2 = np.where(r2 > 0, (r2 + 5) / d, 0)
+    endpoints = np.stack((x1 + dx*f1, y1 + dy*f1, x2 - dx*f2, y2 - dy*f2), axis=1)
+    return ((endpoints - (camera.x, camera.y, camera.x, camera.y)) * camera.zoom).astype(np.float32)
+
+
+class EdgeLayer:
+    # Edges are drawn underneath every other object. Idle edges live pre-rendered on `surface`, which the
+    # renderers use in place of the background, so only edges touching a moving node cost anything per frame.
+    # Highlighted edges stay cached as well, their highlight is simply drawn on top
+    highlight_flags = IS_HOVERED | IS_SELECTED | IS_PREVIEWING
+
+    def __init__(self, size, background=BACKGROUND_COLOR, colors=DEFAULT_COLORS, max_partial_updates:int=64):
+        self.surface = pygame.Surface(size)
+        self.surface.fill(background)
+        self.background = background
+        self.colors = colors
+        self.max_partial_updates = max_partial_updates # Past this many changed edges the cache is repainted as a whole
+        self.store = BaseInteractiveObject.node_store
+        self.camera = BaseInteractiveObject.camera # The cache is in screen space, any camera move repaints it
+        self._camera_version = self.camera.version
+
+        # One row per edge, in the order of `edges`
+        self.edges:List[SimpleObjectConnection] = []
+        self.edge_slots = np.empty(0, np.intp)
+        self.node1_slots = np.empty(0, np.intp)
+        self.node2_slots = np.empty(0, np.intp)
+        self.line_thickness = np.empty(0, np.int32) # World
+        self.thickness = np.empty(0, np.int32) # Screen, like everything below
+        self.endpoints = np.empty((0, 4), np.float32) # x1, y1, x2, y2
+
+        # What's on `surface` right now
+        self.cached = np.empty(0, bool)
+        self.cached_endpoints = np.empty((0, 4), np.float32)
+
+        # What was drawn on top last frame
+        self.live = np.empty(0, np.intp)
+        self.live_state = (np.empty(0, np.intp), np.empty((0, 4), np.float32), np.empty(0, np.uint16))
+        self.live_bounds:List[pygame.Rect] = []
+
+    def _reindex(self, edges:List[SimpleObjectConnection]) -> List[pygame.Rect]:
+        # Carries the cache state over to the new edge list, edges that are gone damage what they left on `surface`
+        old_slots, old_cached, old_endpoints, old_thickness = self.edge_slots, self.cached, self.cached_endpoints, self.thickness
+        self.edges = list(edges)
+        self.edge_slots = np.fromiter((e.unique_id for e in edges), np.intp, len(edges))
+        self.node1_slots = np.fromiter((e.obj1.unique_id for e in edges), np.intp, len(edges))
+        self.node2_slots = np.fromiter((e.obj2.unique_id for e in edges), np.intp, len(edges))
+        self.line_thickness = np.fromiter((e.line_thickness for e in edges), np.int32, len(edges))
+        self.cached = np.zeros(len(edges), bool)
+        self.cached_endpoints = np.zeros((len(edges), 4), np.float32)
+        if not len(old_slots):
+            return []
+
+        order = np.argsort(old_slots)
+        position = np.minimum(np.searchsorted(old_slots[order], self.edge_slots), len(old_slots) - 1)
+        old_index = order[position]
+        found = old_slots[old_index] == self.edge_slots
+        self.cached[found] = old_cached[old_index[found]]
+        self.cached_endpoints[found] = old_endpoints[old_index[found]]
+
+        gone = old_cached.copy()
+        gone[old_index[found]] = False
+        return self._bounds(old_endpoints[gone], old_thickness[gone])
+
+    def _compute_endpoints(self) -> None:
+        self.endpoints = screen_endpoints(self.node1_slots, self.node2_slots)
+        self.thickness = np.maximum(1, np.rint(self.line_thickness * self.camera.zoom)).astype(np.int32)
+
+    def _bounds(self, endpoints:np.ndarray, thickness:np.ndarray) -> List[pygame.Rect]:
+        if len(endpoints) > self.max_partial_updates:
+            return [self.surface.get_rect()]
+        bounds = []
+        for (x1, y1, x2, y2), t in zip(endpoints.tolist(), thickness.tolist()):
+            rect = pygame.Rect(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+            bounds.append(rect.inflate(t + 2, t + 2))
+        return bounds
+
+    def _draw_batch(self, surface:pygame.Surface, index:np.ndarray, styled:bool) -> None:
+        # Outlines of the whole batch first, then the bases on top
+        if not len(index):
+            return
+        ends = self.endpoints[index].tolist()
+        thickness = self.thickness[index].tolist()
+        outline = [self.colors["outline"]] * len(index)
+        previewing = [False] * len(index)
+        if styled:
+            flags = self.store.flags[self.edge_slots[index]]
+            previewing = ((flags & IS_PREVIEWING) != 0).tolist()
+            for i, (f, p) in enumerate(zip(flags.tolist(), previewing)):
+                if p:
+                    outline[i] = self.colors["preview"]
+                elif f & IS_SELECTED:
+                    outline[i] = self.colors["select"]
+                elif f & IS_HOVERED:
+                    outline[i] = self.colors["hover"]
+
+        line, base = pygame.draw.line, self.colors["base"]
+        for (x1, y1, x2, y2), t, color, p in zip(ends, thickness, outline, previewing):
+            line(surface, color, (x1, y1), (x2, y2), width=(t + 2) if p else t)
+        for (x1, y1, x2, y2), t, p in zip(ends, thickness, previewing):
+            if not p:
+                line(surface, base, (x1, y1), (x2, y2), width=max(1, t - 2))
+
+    def _repaint(self, rects:List[pygame.Rect]) -> None:
+        cached = np.flatnonzero(self.cached)
+        ends = self.cached_endpoints[cached]
+        pad = self.thickness[cached] // 2 + 2
+        left, right = np.minimum(ends[:, 0], ends[:, 2]) - pad, np.maximum(ends[:, 0], ends[:, 2]) + pad
+        top, bottom = np.minimum(ends[:, 1], ends[:, 3]) - pad, np.maximum(ends[:, 1], ends[:, 3]) + pad
+        for rect in rects:
+            overlapping = (left < rect.right) & (right >= rect.left) & (top < rect.bottom) & (bottom >= rect.top)
+            self.surface.set_clip(rect)
+            self.surface.fill(self.background)
+            self._draw_batch(self.surface, cached[overlapping], styled=False)
+        self.surface.set_clip(None)
+
+    def sync(self, edges:List[SimpleObjectConnection]) -> List[pygame.Rect]:
+        # Returns the areas that look different from last frame
+        damaged = self._reindex(edges) if edges != self.edges else []
+        self._compute_endpoints()
+
+        store = self.store
+        edge_flags = store.flags[self.edge_slots]
+        node_flags = store.flags[self.node1_slots] | store.flags[self.node2_slots]
+        active = (edge_flags & IS_ACTIVE) != 0
+        moving = (node_flags & IS_ANCHORED) != 0
+        idle = active & ~moving
+
+        # Idle edges that appeared, disappeared or were moved, e.g. by `NodeStore.move`, are repainted on the cache
+        stale = (idle != self.cached) | (idle & np.any(self.endpoints != self.cached_endpoints, axis=1))
+        if stale.any():
+            left = self.cached & stale
+            damaged += self._bounds(self.cached_endpoints[left], self.thickness[left])
+            damaged += self._bounds(self.endpoints[idle & stale], self.thickness[idle & stale])
+            self.cached = idle
+            self.cached_endpoints = np.where(idle[:, None], self.endpoints, self.cached_endpoints)
+        if self.camera.version != self._camera_version:
+            self._camera_version = self.camera.version
+            damaged = [self.surface.get_rect()]
+        if damaged:
+            self._repaint(damaged)
+
+        # Moving and highlighted edges are drawn on top every frame
+        self.live = np.flatnonzero(active & (moving | ((edge_flags & self.highlight_flags) != 0)))
+        live_state = (self.edge_slots[self.live], self.endpoints[self.live], edge_flags[self.live])
+        if any(not np.array_equal(a, b) for a, b in zip(live_state, self.live_state)):
+            damaged += self.live_bounds
+            self.live_bounds = self._bounds(self.endpoints[self.live], self.thickness[self.live])
+            damaged += self.live_bounds
+            self.live_state = live_state
+        return damaged
+
+    def draw_live(self, surface:pygame.Surface) -> None:
+        self._draw_batch(surface, self.live, styled=True)
+
+
+###################################################################
+# Level of detail
+###################################################################
+
+
+class LevelOfDetail:
+    # How much of the scene is drawn, picked every frame from how large nodes end up on screen: the median radius of
+    # the visible circles times the zoom.
+    #   full    everything as it draws itself
+    #   simple  one plain circle per node and one line per edge, no labels
+    #   points  nodes written straight into the pixel buffer, edges as 1 pixel lines
+    # Below full detail the whole frame is drawn here from the node store, edges first, then circles, then anything else
+    def __init__(self, simple_below:float=8, points_below:float=2.5, colors=DEFAULT_COLORS):
+        self.simple_below = simple_below # On screen node radius in pixels
+        self.points_below = points_below
+        self.colors = colors
+        self.store = BaseInteractiveObject.node_store
+        self.camera = BaseInteractiveObject.camera
+        self.tier = LOD_FULL
+        self.screen_radius = float("inf")
+
+        # The visible objects of the frame being drawn, slot arrays are only rebuilt when the lists change
+        self.edges:List[SimpleObjectConnection] = []
+        self.circles:List[Circle] = []
+        self.others:List[BaseInteractiveObject] = []
+        self.edge_slots = self.node1_slots = self.node2_slots = self.circle_slots = np.empty(0, np.intp)
+        self.line_thickness = np.empty(0, np.int32)
+
+    def choose(self, depth_sorted_objects:Sequence) -> str:
+        edges, circles, others = [], [], []
+        for obj in depth_sorted_objects:
+            if isinstance(obj, SimpleObjectConnection):
+                edges.append(obj)
+            elif isinstance(obj, Circle):
+                circles.append(obj)
+            elif not isinstance(obj, TextRectangle): # Labels aren't readable below full detail anyway
+                others.append(obj)
+        if edges != self.edges:
+            self.edges = edges
+            self.edge_slots = np.fromiter((e.unique_id for e in edges), np.intp, len(edges))
+            self.node1_slots = np.fromiter((e.obj1.unique_id for e in edges), np.intp, len(edges))
+            self.node2_slots = np.fromiter((e.obj2.unique_id for e in edges), np.intp, len(edges))
+            self.line_thickness = np.fromiter((e.line_thickness for e in edges), np.int32, len(edges))
+        if circles != self.circles:
+            self.circles = circles
+            self.circle_slots = np.fromiter((c.unique_id for c in circles), np.intp, len(circles))
+        self.others = others
+
+        radius = self.store.radius[self.circle_slots]
+        self.screen_radius = float(np.median(radius)) * self.camera.zoom if len(radius) else float("inf")
+        if self.screen_radius >= self.simple_below:
+            self.tier = LOD_FULL
+        elif self.screen_radius >= self.points_below:
+            self.tier = LOD_SIMPLE
+        else:
+            self.tier = LOD_POINTS
+        return self.tier
+
+    def _palette_index(self, slots:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # 0 base, 1 hover, 2 select, 3 preview, the same precedence as the objects' own `draw`. Plus which ones are drawn at all
+        flags = self.store.flags[slots]
+        index = np.where(flags & IS_PREVIEWING, 3, np.where(flags & IS_SELECTED, 2, np.where(flags & IS_HOVERED, 1, 0)))
+        return index, (flags & IS_ACTIVE) != 0
+
+    def draw(self, screen:pygame.Surface) -> None:
+        # The tier and objects picked by the last `choose`
+        palette = [self.colors["base"], self.colors["hover"], self.colors["select"], self.colors["preview"]]
+        line = pygame.draw.line
+
+        # Edges
+        ends = screen_endpoints(self.node1_slots, self.node2_slots)
+        color_index, active = self._palette_index(self.edge_slots)
+        if self.tier == LOD_SIMPLE:
+            thickness = np.maximum(1, np.rint(self.line_thickness * self.camera.zoom)).astype(np.int32)
+        else:
+            thickness = np.ones(len(ends), np.int32)
+        for (x1, y1, x2, y2), t, c in zip(ends[active].tolist(), thickness[active].tolist(), color_index[active].tolist()):
+            line(screen, palette[c], (x1, y1), (x2, y2), width=t)
+
+        # Circles
+        slots = self.circle_slots
+        refresh_anchored(slots)
+        color_index, active = self._palette_index(slots)
+        slots, color_index = slots[active], color_index[active]
+        camera, store = self.camera, self.store
+        x = (store.x[slots] - camera.x) * camera.zoom
+        y = (store.y[slots] - camera.y) * camera.zoom
+        if self.tier == LOD_SIMPLE:
+            circle = pygame.draw.circle
+            r = store.radius[slots] * camera.zoom
+            for cx, cy, cr, c in zip(x.tolist(), y.tolist(), r.tolist(), color_index.tolist()):
+                circle(screen, palette[c], (cx, cy), cr, width=1 if (c == 3) else 0)
+        else:
+            self._draw_points(screen, x, y, color_index, palette)
+
+        for obj in self.others:
+            if obj.is_active:
+                obj.draw()
+
+    def _draw_points(self, screen:pygame.Surface, x:np.ndarray, y:np.ndarray, color_index:np.ndarray, palette:list) -> None:
+        # Squares of about the node's size, set in the pixel buffer all at once
+        width, height = screen.get_size()
+        side = max(1, min(4, round(2 * self.screen_radius)))
+        left, top = np.rint(x).astype(np.intp) - side // 2, np.rint(y).astype(np.intp) - side // 2
+        inside = (left > -side) & (left < width) & (top > -side) & (top < height)
+        left, top = left[inside], top[inside]
+        if screen.get_bytesize() == 3: # No 2D pixel view of 24 bit surfaces
+            for px, py, c in zip(left.tolist(), top.tolist(), color_index[inside].tolist()):
+                screen.fill(palette[c], (px, py, side, side))
+            return
+        colors = np.array([screen.map_rgb(color) for color in palette], np.uint32)[color_index[inside]]
+        pixels = pygame.surfarray.pixels2d(screen)
+        try:
+            for dx in range(side):
+                for dy in range(side):
+                    px, py = left + dx, top + dy
+                    ok = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+                    pixels[px[ok], py[ok]] = colors[ok]
+        finally:
+            del pixels # Unlocks the screen
+
+
+###################################################################
+# Renderers
+###################################################################
+
+
+class FullRenderer:
+    def __init__(self, screen:pygame.Surface, background=BACKGROUND_COLOR, edge_layer:EdgeLayer|None=None, lod:LevelOfDetail|None=None):
+        self.screen = screen
+        self.background = background
+        self.edge_layer = edge_layer
+        self.lod = lod
+
+    def damage(self, rect:pygame.Rect) -> None:
+        pass # Everything is redrawn every frame anyway
+
+    def remove(self, obj) -> None:
+        pass # Same, nothing to forget
+
+    def render(self, depth_sorted_objects:Sequence) -> None:
+        self.draw(depth_sorted_objects)
+        self.present()
+
+    def draw(self, depth_sorted_objects:Sequence) -> None:
+        if self.lod and (self.lod.choose(depth_sorted_objects) != LOD_FULL):
+            self.screen.fill(self.background)
+            self.lod.draw(self.screen)
+            return
+
+        if self.edge_layer is None:
+            self.screen.fill(self.background)
+        else:
+            edges, depth_sorted_objects = split_edges(depth_sorted_objects)
+            self.edge_layer.sync(edges)
+            self.screen.blit(self.edge_layer.surface, (0, 0))
+            self.edge_layer.draw_live(self.screen)
+
+        for obj in depth_sorted_objects:
+            if obj.is_active:
+                obj.draw()
+
+    def present(self) -> None:
+        pygame.display.flip()
+
+
+class DirtyRectRenderer:
+    # Damaged rects are grown a bit since antialiasing and float centers can bleed a pixel past the bounds
+    damage_margin = 2
+    max_damage_rects = 256 # Past this many in a frame the whole screen is redrawn, merging them would cost more
+
+    def __init__(self, screen:pygame.Surface, background=BACKGROUND_COLOR, cell_size:int=64, edge_layer:EdgeLayer|None=None,
+                 lod:LevelOfDetail|None=None):
+        self.screen = screen
+        self.background = background
+        self.edge_layer = edge_layer
+        self.lod = lod
+        self.camera = BaseInteractiveObject.camera
+        self._camera_version = self.camera.version
+        self._redraw_all = True # Every visible object's bounds are out of date, e.g. the first frame or after a camera move
+        self.grid = SpatialGrid(cell_size)
+        self.drawn:Dict[object, pygame.Rect] = {} # Screen bounds as last drawn
+        self.draw_order:Dict[object, int] = {}
+        self.visible:Sequence = [] # What `draw_order` was built from
+        self.pending:Dict[object, None] = {} # Reported by the scene since the last frame, see `changed`
+        self.damaged:List[pygame.Rect] = [screen.get_rect()]
+        self.dirty_rects:List[pygame.Rect] = [] # Drawn by `draw`, pushed to the display by `present`
+
+    def damage(self, rect:pygame.Rect) -> None:
+        self.damaged.append(rect.inflate(2*self.damage_margin, 2*self.damage_margin))
+
+    def changed(self, objs:List) -> None:
+        # `Scene` listener, objects that were added, moved or restyled
+        self.pending.update(dict.fromkeys(objs))
+
+    def remove(self, obj) -> None:
+        self.pending.pop(obj, None)
+        self.draw_order.pop(obj, None)
+        drawn = self.drawn.pop(obj, None)
+        if drawn is None:
+            return
+        self.damage(drawn)
+        self.grid.remove(obj)
+
+    def _collect_damage(self, depth_sorted_objects:Sequence) -> None:
+        # Only objects the scene reported as changed (through `changed`, as a `Scene` listener) and objects that came
+        # into or went out of view damage their old and new area, so a frame costs what changed rather than what's on
+        # screen. Removed objects damage their old area through `remove`
+        if depth_sorted_objects != self.visible:
+            self.visible = depth_sorted_objects
+            self.draw_order = {obj: i for i, obj in enumerate(depth_sorted_objects)}
+            for obj in [obj for obj in self.drawn if obj not in self.draw_order]:
+                self.remove(obj)
+            self.pending.update(dict.fromkeys(obj for obj in depth_sorted_objects if obj not in self.drawn))
+
+        pending, self.pending = self.pending, {}
+        if self.camera.version != self._camera_version:
+            self._camera_version = self.camera.version
+            self._redraw_all = True
+        if self._redraw_all:
+            self._redraw_all = False
+            self.damaged = [self.screen.get_rect()]
+            for obj in self.draw_order:
+                bounds = obj.get_draw_bounds()
+                self.drawn[obj] = bounds
+                self.grid.update(obj, bounds)
+            return
+
+        for obj in pending:
+            if obj not in self.draw_order:
+                continue # Out of view, or drawn by the edge layer
+            bounds = obj.get_draw_bounds()
+            drawn = self.drawn.get(obj)
+            if drawn is not None:
+                self.damage(drawn)
+            self.damage(bounds)
+            self.drawn[obj] = bounds
+            self.grid.update(obj, bounds)
+
+    def _merge_damage(self) -> List[pygame.Rect]:
+        merged = merge_rects(self.damaged, self.screen.get_rect(), self.max_damage_rects)
+        self.damaged = []
+        return merged
+
+    def render(self, depth_sorted_objects:Sequence) -> None:
+        self.draw(depth_sorted_objects)
+        self.present()
+
+    def draw(self, depth_sorted_objects:Sequence) -> None:
+        # Below full detail tracking damage per object would cost more than drawing the whole frame
+        if self.lod and (self.lod.choose(depth_sorted_objects) != LOD_FULL):
+            self.screen.set_clip(None)
+            self.screen.fill(self.background)
+            self.lod.draw(self.screen)
+            self.damaged = []
+            self.pending = {}
+            self.dirty_rects = [self.screen.get_rect()]
+            self._redraw_all = True # None of this frame can be kept
+            return
+
+        if self.edge_layer is not None:
+            edges, depth_sorted_objects = split_edges(depth_sorted_objects)
+            for rect in self.edge_layer.sync(edges):
+                self.damage(rect)
+
+        self._collect_damage(depth_sorted_objects)
+        self.dirty_rects = self._merge_damage()
+        for rect in self.dirty_rects:
+            self.screen.set_clip(rect)
+            if self.edge_layer is None:
+                self.screen.fill(self.background)
+            else:
+                self.screen.blit(self.edge_layer.surface, rect, rect)
+                self.edge_layer.draw_live(self.screen)
+            overlapping = [obj for obj in self.grid.query_rect(rect) if self.drawn[obj].colliderect(rect)]
+            for obj in sorted(overlapping, key=self.draw_order.__getitem__):
+                if obj.is_active:
+                    obj.draw()
+        self.screen.set_clip(None)
+
+    def present(self) -> None:
+        if self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import bisect
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import pygame
+
+from node_store import IS_MOVED, IS_RESTYLED, IS_UNTRACKED
+from picking import MultiLevelGrid
+from world_object import BaseInteractiveObject, SimpleObjectConnection
+
+
+class Scene:
+    def __init__(self):
+        # `objects` is kept sorted by (depth, insertion order), `_sort_keys` mirrors it for bisect
+        self.objects:List[BaseInteractiveObject] = []
+        self._sort_keys:List[Tuple[float, int]] = []
+        self._object_keys:Dict[BaseInteractiveObject, Tuple[float, int]] = {}
+        self._next_insertion = 0
+        self.version = 0 # Bumped whenever objects are added or removed, so others can tell when to rebuild what they derive from the scene
+
+        # World bounds of every object, for viewport culling and picking. Kept up to date by `sync_index` from what
+        # moved, so an update costs what moved and what's visible rather than the whole scene
+        self.index = MultiLevelGrid()
+
+        # Anything with a `remove(obj)` method, e.g. pickers and renderers, is told when objects leave the scene. Those
+        # with a `changed(objs)` method also hear from `sync_index` which objects were added, moved or restyled since
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self) -> Iterator[BaseInteractiveObject]:
+        return iter(self.objects)
+
+    def __contains__(self, obj:BaseInteractiveObject):
+        return obj in self._object_keys
+
+    def add_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    #---------------------------------
+    # Ordering
+    #---------------------------------
+
+    def _insert(self, obj:BaseInteractiveObject) -> None:
+        key = (obj.depth, self._next_insertion)
+        self._next_insertion += 1
+        i = bisect.bisect_right(self._sort_keys, key)
+        self._sort_keys.insert(i, key)
+        self.objects.insert(i, obj)
+        self._object_keys[obj] = key
+
+    def _pop(self, obj:BaseInteractiveObject) -> None:
+        key = self._object_keys.pop(obj)
+        i = bisect.bisect_left(self._sort_keys, key)
+        del self._sort_keys[i]
+        del self.objects[i]
+
+    def reorder(self, obj:BaseInteractiveObject) -> None:
+        # Called by `BaseInteractiveObject.depth` whenever the depth changes
+        if obj not in self._object_keys:
+            return
+        self._pop(obj)
+        self._insert(obj)
+
+    #---------------------------------
+    # Adding and removing
+    #---------------------------------
+
+    def add(self, obj:BaseInteractiveObject) -> None:
+        # Children, e.g. the label of a circle, come along with their parent
+        if obj in self._object_keys:
+            return
+        self._insert(obj)
+        self.version += 1
+        obj.scene = self
+        obj.node_store.flags[obj.unique_id] |= IS_MOVED # Indexed by the next `sync_index`
+        for child in obj.get_children_objects():
+            self.add(child)
+
+    def add_many(self, objs:List[BaseInteractiveObject], children:bool=True) -> None:
+        # `add` for each object, with the new objects sorted among themselves and merged into `objects` in one pass
+        # instead of an insertion per object. Without `children` the caller promises `objs` already holds every child,
+        # e.g. a loaded scene
+        new = {}
+        stack = list(reversed(objs))
+        while stack: # Parents before their children, like `add`
+            obj = stack.pop()
+            if (obj in new) or (obj in self._object_keys):
+                continue
+            new[obj] = None
+            if children:
+                stack.extend(reversed(obj.get_children_objects()))
+        if not new:
+            return
+        objs = list(new)
+        depths = BaseInteractiveObject.node_store.depth[[obj.unique_id for obj in objs]].tolist()
+        keys = list(zip(depths, range(self._next_insertion, self._next_insertion + len(objs))))
+        for obj, key in zip(objs, keys):
+            self._object_keys[obj] = key
+            obj.scene = self
+        self._next_insertion += len(objs)
+        BaseInteractiveObject.node_store.flags[[obj.unique_id for obj in objs]] |= IS_MOVED
+
+        # Keys are unique, so sorting never gets to compare the objects. The old objects in between two new ones are
+        # copied over as a slice, that part costs next to nothing however large the scene is
+        old_objects, old_keys = self.objects, self._sort_keys
+        objects, sort_keys, start = [], [], 0
+        for key, obj in sorted(zip(keys, objs)):
+            i = bisect.bisect_right(old_keys, key, start)
+            objects += old_objects[start:i]
+            sort_keys += old_keys[start:i]
+            objects.append(obj)
+            sort_keys.append(key)
+            start = i
+        objects += old_objects[start:]
+        sort_keys += old_keys[start:]
+        self.objects, self._sort_keys = objects, sort_keys
+        self.version += 1
+
+    def _collect_dependents(self, obj:BaseInteractiveObject, collected:Dict[BaseInteractiveObject, None]) -> None:
+        if obj in collected:
+            return
+        collected[obj] = None
+        for child in obj.get_children_objects():
+            self._collect_dependents(child, collected)
+
+        # A connection can't outlive either of its nodes, but removing a connection leaves the nodes alone
+        if isinstance(obj, SimpleObjectConnection):
+            return
+        for other in obj.bond_index.get_objects(obj, "--"):
+            if isinstance(other, SimpleObjectConnection):
+                self._collect_dependents(other, collected)
+
+    def remove_many(self, objs:Iterable[BaseInteractiveObject]) -> List[BaseInteractiveObject]:
+        # The objects with their children and connections, found through their bonds, so a group costs what it holds
+        # and what hangs off it. Every pop shifts the rest of `objects`, past a few hundred objects or a good part of
+        # the scene filtering it once is cheaper
+        collected = {}
+        for obj in objs:
+            self._collect_dependents(obj, collected)
+
+        removed = [o for o in collected if o in self._object_keys]
+        self.version += 1
+        if (len(removed) > 256) or (4 * len(removed) > len(self.objects)):
+            for o in removed:
+                del self._object_keys[o]
+            self.objects = [o for o in self.objects if o in self._object_keys]
+            self._sort_keys = [self._object_keys[o] for o in self.objects]
+        else:
+            for o in removed:
+                self._pop(o)
+        for o in removed:
+            self.index.remove(o)
+            o.scene = None
+            for listener in self.listeners:
+                listener.remove(o)
+        return removed
+
+    def remove(self, obj:BaseInteractiveObject) -> List[BaseInteractiveObject]:
+        return self.remove_many([obj])
+
+    def delete_many(self, objs:Iterable[BaseInteractiveObject]) -> List[BaseInteractiveObject]:
+        removed = self.remove_many(objs)
+        for o in removed:
+            o.delete()
+        return removed
+
+    def delete(self, obj:BaseInteractiveObject) -> List[BaseInteractiveObject]:
+        return self.delete_many([obj])
+
+    #---------------------------------
+    # Spatial queries
+    #---------------------------------
+
+    def sync_index(self) -> None:
+        # Re-indexes what moved since the last call and hands everything that changed to the listeners. Sizes that
+        # don't live in the node store, e.g. a rectangle's width, aren't tracked, mark the object with `IS_MOVED` after changing them
+        store = BaseInteractiveObject.node_store
+        for obj in store.objects(store.slots(with_flags=IS_UNTRACKED)):
+            obj._refresh_position() # Following the mouse, which can't say when it moved
+        changed = store.slots(any_flags=IS_MOVED | IS_RESTYLED)
+        if not len(changed):
+            return
+        index, keys = self.index, self._object_keys
+        for obj in store.objects(changed[(store.flags[changed] & IS_MOVED) != 0]):
+            if obj in keys:
+                index.update(obj, obj.get_bounds())
+        store.flags[changed] &= ~np.uint16(IS_MOVED | IS_RESTYLED)
+
+        objs = [obj for obj in store.objects(changed) if obj in keys]
+        for listener in self.listeners:
+            if hasattr(listener, "changed"):
+                listener.changed(objs)
+
+    def in_draw_order(self, objs:Iterable[BaseInteractiveObject]) -> List[BaseInteractiveObject]:
+        # In draw order, objects that aren't in the scene are left out. Once most of the scene is asked for, picking
+        # them out of `objects` is cheaper than sorting
+        keys = self._object_keys
+        objs = objs if isinstance(objs, (set, dict)) else set(objs)
+        if 4 * len(objs) > len(self.objects):
+            return [obj for obj in self.objects if obj in objs]
+        return sorted((obj for obj in objs if obj in keys), key=keys.__getitem__)
+
+    def query_rect(self, rect:pygame.Rect) -> List[BaseInteractiveObject]:
+        # Objects whose bounds overlap `rect` (world), in draw order. Call `sync_index` first
+        bounds = self.index.bounds
+        return self.in_draw_order({obj for obj in self.index.query_rect(rect) if bounds[obj].colliderect(rect)})
+
+    def get_bounds(self) -> pygame.Rect|None:
+        # Everything in the scene, as of the last `sync_index`
+        return self.index.total_bounds()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import json
+from typing import Dict, List
+
+import numpy as np
+import pygame
+
+from helpers import gc_paused
+from node_store import IS_ACTIVE, IS_SELECTABLE, IS_MOVABLE, IS_DELETABLE
+from world_object import BaseInteractiveObject, Circle, MouseAnchor, Rectangle, SimpleObjectConnection, TextRectangle
+from scene import Scene
+
+
+# Usage: save_scene(engine.scene, "graph.npz") / load_scene(engine.scene, engine.screen, "graph.npz"), ".json" for the readable format
+FORMAT_VERSION = 1
+TYPES = (Circle, TextRectangle, Rectangle, SimpleObjectConnection) # Index = type code in the file
+BOND_TYPES = ("-->", "--") # "<--" is the reverse of "-->" and comes back with it
+STATES = {"selectable": IS_SELECTABLE, "movable": IS_MOVABLE, "deletable": IS_DELETABLE, "active": IS_ACTIVE}
+SAVED_FLAGS = IS_SELECTABLE | IS_MOVABLE | IS_DELETABLE | IS_ACTIVE # Hover, selection and placement belong to the session, not the scene
+
+
+###################################################################
+# Scene <-> columns
+###################################################################
+
+
+def _placed_objects(scene:Scene) -> List[BaseInteractiveObject]:
+    # A node still being placed isn't part of the scene yet, neither are its children
+    skipped = set()
+    stack = [obj for obj in scene if obj.is_under_placement]
+    while stack:
+        obj = stack.pop()
+        if obj not in skipped:
+            skipped.add(obj)
+            stack.extend(obj.get_children_objects())
+    return [obj for obj in scene if obj not in skipped]
+
+
+def scene_to_columns(scene:Scene) -> Dict[str, np.ndarray]:
+    # One row per object in draw order, objects refer to each other by row
+    objects = _placed_objects(scene)
+    rows = {obj: i for i, obj in enumerate(objects)}
+    n = len(objects)
+
+    anchor = np.full(n, -1, np.int64)
+    for i, obj in enumerate(objects):
+        target = obj.old_anchor if isinstance(obj.anchor, MouseAnchor) else obj.anchor # A drag ends where it is
+        if target is not None:
+            obj._refresh_position()
+            anchor[i] = rows.get(target, -1)
+
+    store = BaseInteractiveObject.node_store
+    slots = np.fromiter((obj.unique_id for obj in objects), np.intp, n)
+    columns = {"format_version": np.array(FORMAT_VERSION),
+               "type": np.fromiter((TYPES.index(type(obj)) for obj in objects), np.uint8, n),
+               "x": store.x[slots], "y": store.y[slots], "offset_x": store.offset_x[slots], "offset_y": store.offset_y[slots],
+               "radius": store.radius[slots], "depth": store.depth[slots], "flags": store.flags[slots] & SAVED_FLAGS, "anchor": anchor}
+
+    # Type specific, zero for the types that don't have them
+    columns["width"] = np.fromiter((getattr(obj, "width", 0) for obj in objects), np.int32, n)
+    columns["height"] = np.fromiter((getattr(obj, "height", 0) for obj in objects), np.int32, n)
+    columns["text"] = np.array([getattr(obj, "text", "") for obj in objects], dtype=str)
+    columns["font_size"] = np.fromiter((getattr(obj, "font_size", 0) for obj in objects), np.int32, n)
+    columns["font_color"] = np.array([getattr(obj, "font_color", (0, 0, 0)) for obj in objects], np.uint8).reshape(n, 3)
+    columns["line_thickness"] = np.fromiter((getattr(obj, "line_thickness", 0) for obj in objects), np.int32, n)
+    columns["obj1"] = np.fromiter((rows[obj.obj1] if isinstance(obj, SimpleObjectConnection) else -1 for obj in objects), np.int64, n)
+    columns["obj2"] = np.fromiter((rows[obj.obj2] if isinstance(obj, SimpleObjectConnection) else -1 for obj in objects), np.int64, n)
+
+    # Bonds as (row, bond type, row), every bond once
+    bonds = []
+    for obj1, bond_type, obj2 in BaseInteractiveObject.bond_index.bonds:
+        if (obj1 not in rows) or (obj2 not in rows) or (bond_type not in BOND_TYPES):
+            continue
+        if (bond_type == "-->") or (rows[obj1] < rows[obj2]):
+            bonds.append((rows[obj1], BOND_TYPES.index(bond_type), rows[obj2]))
+    columns["bonds"] = np.array(bonds, np.int64).reshape(-1, 3)
+    return columns
+
+
+def columns_to_scene(columns:Dict[str, np.ndarray], scene:Scene, screen:pygame.Surface) -> List[BaseInteractiveObject]:
+    # Builds every type in bulk, then wires up anchors and bonds. Returns the new objects in file order
+    assert int(columns["format_version"]) <= FORMAT_VERSION, f"Scene file is format {int(columns['format_version'])}, this version reads up to {FORMAT_VERSION}"
+    types, x, y, depth, flags = columns["type"], columns["x"], columns["y"], columns["depth"], columns["flags"]
+    objects:List[BaseInteractiveObject|None] = [None] * len(types)
+
+    def place(rows:np.ndarray, objs:List[BaseInteractiveObject]) -> None:
+        for row, obj in zip(rows.tolist(), objs):
+            objects[row] = obj
+
+    rows = np.flatnonzero(types == TYPES.index(Circle))
+    place(rows, Circle.bulk_create(screen, x[rows], y[rows], columns["radius"][rows], depth=depth[rows], flags=flags[rows], labels=False))
+    rows = np.flatnonzero(types == TYPES.index(TextRectangle))
+    place(rows, TextRectangle.bulk_create(screen, x[rows], y[rows], columns["width"][rows], columns["height"][rows], columns["text"][rows].tolist(),
+                                          font_size=columns["font_size"][rows], font_color=columns["font_color"][rows], depth=depth[rows], flags=flags[rows]))
+    rows = np.flatnonzero(types == TYPES.index(Rectangle))
+    place(rows, Rectangle.bulk_create(screen, x[rows], y[rows], columns["width"][rows], columns["height"][rows], depth=depth[rows], flags=flags[rows]))
+
+    # Connections once their nodes exist
+    rows = np.flatnonzero(types == TYPES.index(SimpleObjectConnection))
+    for thickness in np.unique(columns["line_thickness"][rows]).tolist():
+        same = rows[columns["line_thickness"][rows] == thickness]
+        place(same, SimpleObjectConnection.bulk_create(screen, [objects[i] for i in columns["obj1"][same].tolist()], [objects[i] for i in columns["obj2"][same].tolist()],
+                                                       line_thickness=thickness, depth=depth[same], flags=flags[same], bond=False))
+
+    store = BaseInteractiveObject.node_store
+    slots = [obj.unique_id for obj in objects]
+    store.offset_x[slots], store.offset_y[slots] = columns["offset_x"], columns["offset_y"]
+    anchored = np.flatnonzero(columns["anchor"] >= 0).tolist()
+    BaseInteractiveObject.bulk_anchor([objects[i] for i in anchored], [objects[i] for i in columns["anchor"][anchored].tolist()])
+    bonds = columns["bonds"]
+    for code, bond_type in enumerate(BOND_TYPES):
+        same = bonds[bonds[:, 1] == code]
+        BaseInteractiveObject.bond_index.add_pairs([objects[i] for i in same[:, 0].tolist()], bond_type, [objects[i] for i in same[:, 2].tolist()])
+
+    scene.add_many(objects, children=False)
+    return objects
+
+
+###################################################################
+# Files
+###################################################################
+
+
+def _columns_to_json(columns:Dict[str, np.ndarray]) -> dict:
+    objects = []
+    for i, code in enumerate(columns["type"].tolist()):
+        cls = TYPES[code]
+        flags = int(columns["flags"][i])
+        record = {"type": cls.__name__, "x": float(columns["x"][i]), "y": float(columns["y"][i]),
+                  "offset_x": float(columns["offset_x"][i]), "offset_y": float(columns["offset_y"][i]), "depth": float(columns["depth"][i]),
+                  "states": [name for name, bit in STATES.items() if flags & bit]}
+        if cls is SimpleObjectConnection:
+            del record["x"], record["y"] # No position of its own, it runs between its nodes
+            record.update(obj1=int(columns["obj1"][i]), obj2=int(columns["obj2"][i]), line_thickness=int(columns["line_thickness"][i]))
+        if cls is Circle:
+            record["radius"] = float(columns["radius"][i])
+        if cls in (Rectangle, TextRectangle):
+            record.update(width=int(columns["width"][i]), height=int(columns["height"][i]))
+        if cls is TextRectangle:
+            record.update(text=str(columns["text"][i]), font_size=int(columns["font_size"][i]), font_color=columns["font_color"][i].tolist())
+        if columns["anchor"][i] >= 0:
+            record["anchor"] = int(columns["anchor"][i])
+        objects.append(record)
+    bonds = [[i, BOND_TYPES[code], j] for i, code, j in columns["bonds"].tolist()]
+    return {"format_version": FORMAT_VERSION, "objects": objects, "bonds": bonds}
+
+
+def _json_to_columns(data:dict) -> Dict[str, np.ndarray]:
+    records = data["objects"]
+    names = [cls.__name__ for cls in TYPES]
+    def column(key, default, dtype):
+        return np.array([record.get(key, default) for record in records], dtype)
+    return {"format_version": np.array(data["format_version"]),
+            "type": np.array([names.index(record["type"]) for record in records], np.uint8),
+            "x": column("x", np.nan, np.float32), "y": column("y", np.nan, np.float32),
+            "offset_x": column("offset_x", 0, np.float32), "offset_y": column("offset_y", 0, np.float32),
+            "radius": column("radius", 0, np.float32), "depth": column("depth", 0, np.float32),
+            "flags": np.array([sum(STATES[name] for name in record.get("states", [])) for record in records], np.uint16),
+            "anchor": column("anchor", -1, np.int64), "width": column("width", 0, np.int32), "height": column("height", 0, np.int32),
+            "text": np.array([record.get("text", "") for record in records], dtype=str), "font_size": column("font_size", 0, np.int32),
+            "font_color": column("font_color", (0, 0, 0), np.uint8).reshape(len(records), 3),
+            "line_thickness": column("line_thickness", 0, np.int32), "obj1": column("obj1", -1, np.int64), "obj2": column("obj2", -1, np.int64),
+            "bonds": np.array([[i, BOND_TYPES.index(bond_type), j] for i, bond_type, j in data["bonds"]], np.int64).reshape(-1, 3)}
+
+
+def save_scene(scene:Scene, path:str) -> None:
+    # `.json` is written as readable JSON, anything else as an uncompressed `.npz` of the columns
+    columns = scene_to_columns(scene)
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(_columns_to_json(columns), f, indent=1)
+    else:
+        with open(path, "wb") as f: # A file object, so `np.savez` doesn't append ".npz" to the name
+            np.savez(f, **columns)
+
+
+def load_scene(scene:Scene, screen:pygame.Surface, path:str) -> List[BaseInteractiveObject]:
+    # Adds the saved objects to `scene`, next to whatever is in it already
+    if path.endswith(".json"):
+        with open(path) as f:
+            columns = _json_to_columns(json.load(f))
+    else:
+        with np.load(path) as data:
+            columns = dict(data)
+    with gc_paused():
+        return columns_to_scene(columns, scene, screen)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pygame
+
+from helpers import DEFAULT_COLORS
+from node_store import IS_ACTIVE, IS_ANCHORED, IS_DELETABLE, IS_MOVABLE, IS_PINNED, IS_RESTYLED, IS_SELECTABLE, IS_SELECTED
+from world_object import BaseInteractiveObject, SimpleObjectConnection
+from scene import Scene
+
+
+###################################################################
+# Group selection
+###################################################################
+
+
+class GroupSelection:
+    # Nodes selected together with a rubber band, moved and deleted as one. Members are free standing objects, whatever
+    # is anchored to them (labels) and the connections between them come along. A `Scene` listener, so members that
+    # leave the scene some other way drop out
+    def __init__(self, scene:Scene, min_band_size:int=4, colors:dict=DEFAULT_COLORS):
+        self.scene = scene
+        self.store = BaseInteractiveObject.node_store
+        self.camera = BaseInteractiveObject.camera
+        self.min_band_size = min_band_size # Screen pixels, a smaller band is a click on empty space
+        self.colors = colors
+        self.members:Dict[BaseInteractiveObject, None] = {} # Insertion ordered set
+        self._slots:np.ndarray|None = None # Slots of `members`, rebuilt after a change
+
+        # Rubber band, in world coordinates so it stays put when the camera moves
+        self.band_start:Tuple[float, float]|None = None
+        self.band_end:Tuple[float, float]|None = None
+        self._band_drawn:pygame.Rect|None = None # On screen, last frame
+
+        # Group drag, the world point the mouse was at last update
+        self._grab:Tuple[float, float]|None = None
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[BaseInteractiveObject]:
+        return iter(self.members)
+
+    def __contains__(self, obj):
+        return obj in self.members
+
+    @property
+    def slots(self) -> np.ndarray:
+        if self._slots is None:
+            self._slots = np.fromiter((obj.unique_id for obj in self.members), np.intp, len(self.members))
+        return self._slots
+
+    #---------------------------------
+    # Members
+    #---------------------------------
+
+    def select(self, objs:List[BaseInteractiveObject], add:bool=False) -> None:
+        if not add:
+            self.clear()
+        for obj in objs:
+            self.members[obj] = None
+        self._slots = None
+        self.store.flags[self.slots] |= IS_SELECTED | IS_RESTYLED
+        if self.is_dragging(): # Joining a group that's being dragged
+            self.store.flags[self.slots] |= IS_PINNED
+
+    def clear(self) -> None:
+        if self.members:
+            slots = self.slots
+            self.store.flags[slots] &= ~np.uint16(IS_SELECTED | IS_PINNED)
+            self.store.flags[slots] |= IS_RESTYLED
+        self.members = {}
+        self._slots = None
+        self._grab = None
+
+    def remove(self, obj) -> None:
+        if obj in self.members:
+            del self.members[obj]
+            self._slots = None
+            obj.is_selected = False
+            self.store.flags[obj.unique_id] &= ~np.uint16(IS_PINNED)
+
+    #---------------------------------
+    # Rubber band
+    #---------------------------------
+
+    def is_banding(self) -> bool:
+        return self.band_start is not None
+
+    def begin_band(self, x:float, y:float) -> None:
+        self.band_start = self.band_end = (x, y)
+
+    def update_band(self, x:float, y:float) -> None:
+        self.band_end = (x, y)
+
+    def band_rect(self) -> pygame.Rect|None:
+        # World
+        if self.band_start is None:
+            return None
+        (x0, y0), (x1, y1) = self.band_start, self.band_end
+        left, top = int(np.floor(min(x0, x1))), int(np.floor(min(y0, y1)))
+        return pygame.Rect(left, top, int(np.ceil(max(x0, x1))) - left, int(np.ceil(max(y0, y1))) - top)
+
+    def query_band(self) -> List[BaseInteractiveObject]:
+        # Free standing, active and selectable objects whose center is inside the band, through the scene's spatial index
+        rect = self.band_rect()
+        self.scene.sync_index()
+        candidates = [obj for obj in self.scene.query_rect(rect) if not isinstance(obj, SimpleObjectConnection)]
+        if not candidates:
+            return []
+        store = self.store
+        slots = np.fromiter((obj.unique_id for obj in candidates), np.intp, len(candidates))
+        flags = store.flags[slots]
+        x, y = store.x[slots] + store.offset_x[slots], store.y[slots] + store.offset_y[slots]
+        keep = ((flags & (IS_ACTIVE | IS_SELECTABLE)) == (IS_ACTIVE | IS_SELECTABLE)) & ((flags & IS_ANCHORED) == 0)
+        keep &= (x >= rect.left) & (x < rect.right) & (y >= rect.top) & (y < rect.bottom)
+        return [candidates[i] for i in np.flatnonzero(keep).tolist()]
+
+    def end_band(self, add:bool=False) -> List[BaseInteractiveObject]:
+        # Selects what's in the band, or with `add` adds it to the selection. Returns the newly selected objects
+        rect = self.camera.to_screen_rect(self.band_rect())
+        small = max(rect.width, rect.height) < self.min_band_size
+        objs = [] if small else self.query_band()
+        self.band_start = self.band_end = None
+        self.select(objs, add=add)
+        return objs
+
+    #---------------------------------
+    # Group operations
+    #---------------------------------
+
+    def move_by(self, dx:float, dy:float) -> None:
+        # One vectorized offset for the whole group, anchored labels and the connections follow through invalidation
+        slots = self.slots
+        self.store.move(slots[(self.store.flags[slots] & IS_MOVABLE) != 0], dx, dy)
+
+    def is_dragging(self) -> bool:
+        return self._grab is not None
+
+    def begin_drag(self, x:float, y:float) -> None:
+        # Pinned until `end_drag`, so a running layout doesn't pull the members away from under the mouse
+        self._grab = (x, y)
+        self.store.flags[self.slots] |= IS_PINNED
+
+    def drag_to(self, x:float, y:float) -> None:
+        dx, dy = x - self._grab[0], y - self._grab[1]
+        if dx or dy:
+            self.move_by(dx, dy)
+        self._grab = (x, y)
+
+    def end_drag(self) -> None:
+        self._grab = None
+        self.store.flags[self.slots] &= ~np.uint16(IS_PINNED)
+
+    def delete(self) -> List[BaseInteractiveObject]:
+        # The deletable members with their labels and connections, in one pass over the scene. Returns what was deleted
+        deletable = [obj for obj, flags in zip(self.members, self.store.flags[self.slots].tolist()) if flags & IS_DELETABLE]
+        self.clear()
+        return self.scene.delete_many(deletable)
+
+    #---------------------------------
+    # Drawing
+    #---------------------------------
+
+    def band_damage(self) -> List[pygame.Rect]:
+        # For dirty-rect rendering, both where the band was and where it's about to be have to be redrawn
+        rects = [] if (self._band_drawn is None) else [self._band_drawn]
+        if self.band_start is not None:
+            rects.append(self.camera.to_screen_rect(self.band_rect()))
+        return rects
+
+    def draw_band(self, screen:pygame.Surface) -> None:
+        if self.band_start is None:
+            self._band_drawn = None
+            return
+        rect = self.camera.to_screen_rect(self.band_rect()).clip(screen.get_rect())
+        self._band_drawn = rect
+        if not rect.width or not rect.height:
+            return
+        fill = pygame.Surface(rect.size, pygame.SRCALPHA)
+        fill.fill((*self.colors["select"], 40))
+        screen.blit(fill, rect)
+        pygame.draw.rect(screen, self.colors["select"], rect, width=1)
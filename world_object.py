@@ -1,21 +1,184 @@
 from __future__ import annotations
 
+import sys
 import warnings
 
 import numpy as np
 import pygame
-from helpers import DEFAULT_COLORS
+from helpers import DEFAULT_COLORS, point_segment_distance
 from input_management import Mouse, Keyboard
-from typing import List
+from fonts import get_font, label_cache
+from camera import Camera
+from registry import IdAllocator, ObjectRegistry, short_label
+from node_store import (NodeStore, StoreField, StoreFlag, position_or_none, IS_SELECTED, IS_HOVERED, IS_ACTIVE, IS_SELECTABLE,
+                        IS_MOVABLE, IS_PREVIEWING, IS_UNDER_PLACEMENT, IS_DELETABLE, IS_ANCHORED, IS_DIRTY, IS_UNTRACKED, IS_MOVED,
+                        IS_RESTYLED)
+from typing import Dict, List, Tuple
 
 ###################################################################
 # Helper classes - Large
 ###################################################################
 
 
+class BondIndex:
+    def __init__(self):
+        # (obj1, bond_type, obj2) -> bond, plus obj1 -> bond_type -> obj2 -> bond for the per-object queries
+        self.bonds:Dict[Tuple[BaseInteractiveObject, str, BaseInteractiveObject], GenericBond] = {}
+        self.bonds_by_object:Dict[BaseInteractiveObject, Dict[str, Dict[BaseInteractiveObject, GenericBond]]] = {}
+
+    def __len__(self):
+        return len(self.bonds)
+
+    def __contains__(self, bond:GenericBond):
+        return bond.key in self.bonds
+
+    def add(self, bond:GenericBond) -> bool:
+        if bond.key in self.bonds:
+            return False
+        self.bonds[bond.key] = bond
+        by_type = self.bonds_by_object.setdefault(bond.obj1, {})
+        by_type.setdefault(bond.bond_type, {})[bond.obj2] = bond
+        return True
+
+    def add_pairs(self, objs1:List[BaseInteractiveObject], bond:str, objs2:List[BaseInteractiveObject]) -> None:
+        # `obj1.add_bond(bond, obj2, add_to_other_as_well=True)` pairwise, existing bonds are left as they are.
+        # `add` inlined, this runs once per bond when building large scenes
+        bond_type = GenericBond.bond_mapper[bond]
+        reversed_type = GenericBond.reversed_types[bond_type]
+        bonds, bonds_by_object, new_bond = self.bonds, self.bonds_by_object, GenericBond.__new__
+        for obj1, obj2 in zip(objs1, objs2):
+            assert obj1 != obj2
+            for a, a_to_b, b_to_a, b in ((obj1, bond_type, reversed_type, obj2), (obj2, reversed_type, bond_type, obj1)):
+                key = (a, a_to_b, b)
+                if key in bonds:
+                    continue
+                new = bonds[key] = new_bond(GenericBond)
+                new.obj1, new.bond_type, new.obj2, new.reversed = a, a_to_b, b, b_to_a
+                by_type = bonds_by_object.get(a)
+                if by_type is None:
+                    by_type = bonds_by_object[a] = {}
+                others = by_type.get(a_to_b)
+                if others is None:
+                    others = by_type[a_to_b] = {}
+                others[b] = new
+
+    def remove(self, obj1:BaseInteractiveObject, bond_type:str, obj2:BaseInteractiveObject) -> GenericBond|None:
+        bond = self.bonds.pop((obj1, bond_type, obj2), None)
+        if bond is None:
+            return None
+        by_type = self.bonds_by_object[obj1]
+        del by_type[bond_type][obj2]
+        if not by_type[bond_type]:
+            del by_type[bond_type]
+        if not by_type:
+            del self.bonds_by_object[obj1]
+        return bond
+
+    def remove_all(self, obj:BaseInteractiveObject) -> None:
+        for others in self.bonds_by_object.pop(obj, {}).values():
+            for bond in others.values():
+                del self.bonds[bond.key]
+
+    def get_bonds(self, obj:BaseInteractiveObject, bond_type:str|None=None) -> List[GenericBond]:
+        by_type = self.bonds_by_object.get(obj)
+        if not by_type:
+            return []
+        if bond_type is not None:
+            return list(by_type.get(bond_type, {}).values())
+        return [bond for others in by_type.values() for bond in others.values()]
+
+    def get_objects(self, obj:BaseInteractiveObject, bond_type:str|None=None) -> List[BaseInteractiveObject]:
+        by_type = self.bonds_by_object.get(obj)
+        if not by_type:
+            return []
+        if bond_type is not None:
+            return list(by_type.get(bond_type, {}))
+        return [other for others in by_type.values() for other in others]
+
+    def degree(self, obj:BaseInteractiveObject, bond_type:str|None=None) -> int:
+        by_type = self.bonds_by_object.get(obj, {})
+        if bond_type is not None:
+            return len(by_type.get(bond_type, {}))
+        return sum(len(others) for others in by_type.values())
+
+
+class ConnectionIndex:
+    def __init__(self):
+        # {node_a, node_b} -> the connection between them, order doesn't matter
+        self.connections:Dict[frozenset, SimpleObjectConnection] = {}
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __contains__(self, connection:SimpleObjectConnection):
+        return self.connections.get(connection.node_pair) is connection
+
+    def add(self, connection:SimpleObjectConnection) -> bool:
+        if connection.node_pair in self.connections:
+            return False
+        self.connections[connection.node_pair] = connection
+        return True
+
+    def remove(self, connection:SimpleObjectConnection) -> None:
+        if self.connections.get(connection.node_pair) is connection:
+            del self.connections[connection.node_pair]
+
+    def between(self, node_a:BaseInteractiveObject, node_b:BaseInteractiveObject) -> SimpleObjectConnection|None:
+        return self.connections.get(frozenset((node_a, node_b)))
+
+
+def _release_unique_id(id_allocator:IdAllocator, node_store:NodeStore, unique_id:int) -> None:
+    node_store.release(unique_id)
+    id_allocator.release(unique_id)
+
+
+def _per_object(value, n:int, width:int|None=None) -> list:
+    # Bulk constructor arguments are a single value for all objects or one per object
+    value = np.asarray(value)
+    shape = (n,) if (width is None) else (n, width)
+    return np.broadcast_to(value, shape).tolist()
+
+
+class _ReleaseOnce:
+    # Calls `release(*args)` once: when called, e.g. by `delete()`, or as a fallback when its owner is garbage collected.
+    # Like `weakref.finalize`, but it dies with its owner instead of sitting in a global registry, which makes it a lot cheaper
+    __slots__ = ("release", "args")
+
+    def __init__(self, release, *args):
+        self.release = release
+        self.args = args
+
+    def __call__(self):
+        release, self.release = self.release, None
+        if release is not None:
+            release(*self.args)
+
+    def __del__(self, is_finalizing=sys.is_finalizing):
+        if not is_finalizing(): # Nothing left worth releasing at interpreter shutdown
+            self()
+
+
 class BaseInteractiveObject:
-    unique_ids = []
-    unique_object_ids = list([*'abcdefghijklmnopqrstuvwxyz'.upper(), *[str(i) for i in range(100)]])
+    __slots__ = ("object_type", "screen", "colors", "depth_color", "unique_id", "_unique_id_finalizer",
+                 "_anchor", "old_anchor", "scene", "__weakref__")
+
+    id_allocator = IdAllocator()
+    registry = ObjectRegistry()
+    node_store = NodeStore() # Positions, depth and `is` states live here, indexed by `unique_id`
+    bond_index = BondIndex()
+    connection_index = ConnectionIndex()
+    camera = Camera() # Positions are world coordinates, `draw`/`draw_depth`/`get_draw_bounds` go through the camera to the screen
+
+    offset_x = StoreField(invalidates=True)
+    offset_y = StoreField(invalidates=True)
+    is_selected = StoreFlag(IS_SELECTED, restyles=True)
+    is_hovered = StoreFlag(IS_HOVERED, restyles=True)
+    is_active = StoreFlag(IS_ACTIVE, restyles=True)
+    is_selectable = StoreFlag(IS_SELECTABLE)
+    is_movable = StoreFlag(IS_MOVABLE)
+    is_previewing = StoreFlag(IS_PREVIEWING, restyles=True)
+    is_under_placement = StoreFlag(IS_UNDER_PLACEMENT)
+    is_deletable = StoreFlag(IS_DELETABLE)
 
     def __init__(self, object_type, screen,
                  x:int|None, y:int|None, offset_x=0, offset_y=0, anchor=None, depth=0,
@@ -27,18 +190,20 @@ class BaseInteractiveObject:
         self.screen = screen
         self.colors = DEFAULT_COLORS
         self.depth_color = (255,255,255)
-        self.unique_id = self.unique_object_ids.pop(0)
-        assert self.unique_id not in self.unique_ids
-        self.unique_ids.append(self.unique_id)
+        self.unique_id = self.id_allocator.allocate()
+        self.registry.register(self)
+        self.node_store.add(self.unique_id, self)
+        self._unique_id_finalizer = _ReleaseOnce(_release_unique_id, self.id_allocator, self.node_store, self.unique_id) # Releases the ID on `delete()` or, as a fallback, on garbage collection
 
         # Placement
+        self.scene = None # Set by `Scene.add`
         self._x = x # center
         self._y = y # center
         self.anchor = anchor
         self.old_anchor = anchor
         self.offset_x = offset_x
         self.offset_y = offset_y
-        self.depth = depth
+        self.node_store.depth[self.unique_id] = depth
 
         # `is` states
         self.is_selected = is_selected
@@ -50,17 +215,77 @@ class BaseInteractiveObject:
         self.is_under_placement = is_under_placement
         self.is_deletable = is_deletable
 
-        # Bonds
-        self.bonds:List[GenericBond] = []
+    # The raw stored center, `x`/`y` add the offset and follow the anchor. Any actual change dirties the dependents
+    @property
+    def _x(self):
+        return position_or_none(self.node_store.x[self.unique_id])
+
+    @_x.setter
+    def _x(self, value):
+        self._store_position(self.node_store.x, value)
+
+    @property
+    def _y(self):
+        return position_or_none(self.node_store.y[self.unique_id])
+
+    @_y.setter
+    def _y(self, value):
+        self._store_position(self.node_store.y, value)
+
+    def _store_position(self, column:np.ndarray, value) -> None:
+        value = np.float32(np.nan if (value is None) else value)
+        if column[self.unique_id] == value:
+            return
+        column[self.unique_id] = value
+        self.node_store.flags[self.unique_id] |= IS_MOVED
+        self.node_store.invalidate(self.unique_id)
+
+    @property
+    def anchor(self):
+        return self._anchor
+
+    @anchor.setter
+    def anchor(self, value):
+        store, slot = self.node_store, self.unique_id
+        old_anchor = getattr(self, "_anchor", None)
+        if isinstance(old_anchor, BaseInteractiveObject):
+            store.undepend(slot, old_anchor.unique_id)
+
+        self._anchor = value
+        store.flags[slot] &= ~np.uint16(IS_ANCHORED | IS_UNTRACKED)
+        if value is None:
+            return
+        store.flags[slot] |= IS_ANCHORED | IS_DIRTY | IS_MOVED
+        if isinstance(value, BaseInteractiveObject):
+            store.depend(slot, value.unique_id) # Pushes invalidation down to us whenever the anchor moves
+        else:
+            store.flags[slot] |= IS_UNTRACKED
+
+    def _refresh_position(self) -> None:
+        # Anchored objects only re-read an object anchor after it moved. Other anchors, e.g. the mouse, can't tell us when they move
+        anchor = self._anchor
+        if anchor is None:
+            return
+        store, slot = self.node_store, self.unique_id
+        if isinstance(anchor, BaseInteractiveObject):
+            anchor._refresh_position()
+            if not (store.flags[slot] & IS_DIRTY):
+                store.reused += 1
+                return
+        store.flags[slot] &= ~np.uint16(IS_DIRTY)
+        store.recomputed += 1
+        self._x = anchor.x + self.offset_x
+        self._y = anchor.y + self.offset_y
 
     @property
     def x(self):
         if self._x is None:
             return None
             #raise RuntimeError("`x` has been set to None. This mean you cannot access its position this way")
+        if self._anchor is not None:
+            self._refresh_position()
+            return self._x
         x = self._x + self.offset_x
-        if self.anchor is not None:
-            x = self.anchor.x + self.offset_x
         self._x = x # I don't wanna deal with discrepancies between the object's coordinates before and after an anchor get assigned/removed
         return x
 
@@ -69,9 +294,10 @@ class BaseInteractiveObject:
         if self._y is None:
             return None
             #raise RuntimeError("`y` has been set to None. This mean you cannot access its position this way")
+        if self._anchor is not None:
+            self._refresh_position()
+            return self._y
         y = self._y + self.offset_y
-        if self.anchor is not None:
-            y = self.anchor.y + self.offset_y
         self._y = y # I don't wanna deal with discrepancies between the object's coordinates before and after an anchor get assigned/removed
         return y
 
@@ -85,6 +311,19 @@ class BaseInteractiveObject:
         assert self.anchor is None, "You cannot change the position of an anchor. Either remove the anchor or change the <self>.offset_y instead"
         self._y = value
 
+    @property
+    def depth(self):
+        return float(self.node_store.depth[self.unique_id])
+
+    @depth.setter
+    def depth(self, value):
+        if value == self.depth:
+            return
+        self.node_store.depth[self.unique_id] = value
+        self.node_store.flags[self.unique_id] |= IS_RESTYLED # Drawn in a different order
+        if self.scene is not None:
+            self.scene.reorder(self)
+
     def __repr__(self):
         to_write = f"type: {self.object_type}, x: {self.x}, y: {self.y}, depth: {self.depth}, selected: {int(self.is_selected)}, "\
                    f"hovered: {int(self.is_hovered)}, previewing: {int(self.is_previewing)}, active: {int(self.is_active)}, " \
@@ -94,7 +333,7 @@ class BaseInteractiveObject:
     def get_connection_anchor(self, interact:BaseInteractiveObject) -> SimpleAnchor|BaseInteractiveObject:
         return self
 
-    def respond(self, mouse:Mouse, keyboard:Keyboard, depth_map:np.ndarray):
+    def respond(self, mouse:Mouse, keyboard:Keyboard, picked:BaseInteractiveObject|None):
         raise NotImplemented
 
     def interact(self, interact:BaseInteractiveObject=None):
@@ -106,37 +345,107 @@ class BaseInteractiveObject:
     def draw(self):
         raise NotImplemented
 
+    def get_bounds(self) -> pygame.Rect:
+        raise NotImplementedError
+
+    def contains_point(self, x, y) -> bool:
+        raise NotImplementedError
+
+    def get_draw_bounds(self) -> pygame.Rect:
+        # On screen, unlike `get_bounds`
+        return self.camera.to_screen_rect(self.get_bounds())
+
+    @property
+    def bonds(self) -> List[GenericBond]:
+        return self.bond_index.get_bonds(self)
+
     def add_bond(self, bond:str, other:BaseInteractiveObject, add_to_other_as_well:bool=False) -> None:
         # Add bond to current object
         new_bond = GenericBond(self, bond, other)
-        # if any([b == new_bond for b in self.bonds]):
-        #     warnings.warn(f"The bond `{new_bond.obj1.object_type} {new_bond.bond} {new_bond.obj2.object_type}` already exists in `self`")
-        #     return
-        self.bonds.append(new_bond)
+        if not self.bond_index.add(new_bond):
+            warnings.warn(f"The bond `{new_bond.obj1.object_type} {new_bond.bond_type} {new_bond.obj2.object_type}` already exists in `self`")
+            return
 
         # Add object to other object
         if add_to_other_as_well:
             other.add_bond(bond=new_bond.reversed, other=self, add_to_other_as_well=False)
 
-    def remove_bond(self, bond):
-        assert bond in self.bonds
-        self.bonds = [b for b in self.bonds if (b != bond)]
+    def remove_bond(self, bond:GenericBond):
+        # `bond` may be seen from either end, e.g. `other.remove_bond(bond)` with one of `self.bonds`
+        if bond.obj1 is self:
+            removed = self.bond_index.remove(self, bond.bond_type, bond.obj2)
+        else:
+            removed = self.bond_index.remove(self, bond.reversed, bond.obj1)
+        assert removed is not None
 
     def delete_all_bonds(self):
         for bond in self.bonds:
-            bond.obj2.remove_bond(bond)
-        self.bonds = []
+            if bond.reversed_key in self.bond_index.bonds:
+                bond.obj2.remove_bond(bond)
+            if isinstance(bond.obj2, SimpleObjectConnection):
+                self.connection_index.remove(bond.obj2)
+        self.bond_index.remove_all(self)
+
+    def delete(self):
+        # Children (e.g. the label of a circle) don't outlive their parent
+        for child in self.get_children_objects():
+            child.delete()
+        self.delete_all_bonds()
+        self.registry.unregister(self)
+        self._unique_id_finalizer()
 
     def get_all_objects(self, including_self:bool=False) -> List[BaseInteractiveObject]:
         if including_self:
-            return [self] + [bond.obj2 for bond in self.bonds]
-        return [bond.obj2 for bond in self.bonds]
+            return [self] + self.bond_index.get_objects(self)
+        return self.bond_index.get_objects(self)
 
     def get_parent_objects(self) -> List[BaseInteractiveObject]:
-        return [bond.obj2 for bond in self.bonds if (bond.bond_type == "<--")]
+        return self.bond_index.get_objects(self, "<--")
 
     def get_children_objects(self) -> List[BaseInteractiveObject]:
-        return [bond.obj2 for bond in self.bonds if (bond.bond_type == "-->")]
+        return self.bond_index.get_objects(self, "-->")
+
+    #---------------------------------
+    # Bulk construction
+    #---------------------------------
+
+    @classmethod
+    def _bulk_new(cls, screen, n:int, x=np.nan, y=np.nan, offset_x=0, offset_y=0, depth=0, flags=0) -> List[BaseInteractiveObject]:
+        # `n` objects without running `__init__`. IDs, registry and store rows are handled in one go, the position, depth
+        # and flag arguments are scalars or one value per object. Subclasses fill in their own attributes afterwards
+        id_allocator, store = cls.id_allocator, cls.node_store
+        ids = id_allocator.allocate_many(n)
+        objs = []
+        for unique_id in ids:
+            obj = cls.__new__(cls)
+            obj.object_type = cls.__name__
+            obj.screen = screen
+            obj.colors = DEFAULT_COLORS
+            obj.depth_color = (255,255,255)
+            obj.unique_id = unique_id
+            obj._unique_id_finalizer = _ReleaseOnce(_release_unique_id, id_allocator, store, unique_id)
+            obj.scene = None
+            obj._anchor = None
+            obj.old_anchor = None
+            objs.append(obj)
+        cls.registry.register_many(objs)
+        store.add_many(ids, objs)
+        store.x[ids], store.y[ids] = x, y
+        store.offset_x[ids], store.offset_y[ids] = offset_x, offset_y
+        store.depth[ids] = depth
+        store.flags[ids] = flags
+        return objs
+
+    @staticmethod
+    def bulk_anchor(objs:List[BaseInteractiveObject], anchors:List[BaseInteractiveObject]) -> None:
+        # `obj.anchor = anchor` pairwise for freshly built objects anchored to other objects
+        for obj, anchor in zip(objs, anchors):
+            obj._anchor = anchor
+            obj.old_anchor = anchor
+        slots = [obj.unique_id for obj in objs]
+        store = BaseInteractiveObject.node_store
+        store.flags[slots] |= IS_ANCHORED
+        store.depend_many(slots, [anchor.unique_id for anchor in anchors])
 
 ###################################################################
 # Helper classes - Small
@@ -183,7 +492,9 @@ class MouseAnchor:
         return self.mouse.y + self.offset_y
 
 class GenericBond:
+    __slots__ = ("obj1", "bond_type", "obj2", "reversed")
     bond_mapper = {"i_am_parent_of":"-->", "i_am_in_connection_with":"--", "i_am_child_off":"<--", "-->":"-->", "--":"--", "<--":"<--"}
+    reversed_types = {"--":"--", "-->":"<--", "<--":"-->"}
 
     def __init__(self, obj1:BaseInteractiveObject, bond:str, obj2:BaseInteractiveObject):
         # Setup and checks
@@ -201,25 +512,22 @@ class GenericBond:
         if self.bond_type == "<--":
             self.reversed = "-->"
 
-    def __eq__(self, other):
-        A1, C1, B1 = self.obj1, self.bond_type, self.obj2
-        A2, C2, B2 = other.obj1, other.bond_type, other.obj2
+    @property
+    def key(self) -> Tuple[BaseInteractiveObject, str, BaseInteractiveObject]:
+        return self.obj1, self.bond_type, self.obj2
 
-        # The obvious one:
-        if (A1 == A2) and (C1 != C2) and (B1 != B2):
-            return True
+    @property
+    def reversed_key(self) -> Tuple[BaseInteractiveObject, str, BaseInteractiveObject]:
+        return self.obj2, self.reversed, self.obj1
 
-        # The crossed one:
-        if (A1 == B2) and (A2 == B1):
-            if (C1 == "--") and (C2 == "--"):
-                return True
-            if (C1 == "-->") and ("<--" == C2):
-                return True
-            if (C1 == "<--") and ("-->" == C2):
-                return True
+    def __eq__(self, other):
+        # `A --> B` and `B <-- A` are the same bond seen from either end
+        if not isinstance(other, GenericBond):
+            return NotImplemented
+        return (self.key == other.key) or (self.key == other.reversed_key)
 
-        # Must be false otherwise
-        return False
+    def __hash__(self):
+        return hash(frozenset((self.key, self.reversed_key)))
 
 
 ###################################################################
@@ -228,17 +536,28 @@ class GenericBond:
 
 
 class Rectangle(BaseInteractiveObject):
+    __slots__ = ("width", "height")
+
     def __init__(self, screen, x, y, width, height, offset_x=0, offset_y=0, anchor=None, depth=0, is_previewing = False, is_selected = False, is_hovered = False, is_active = True, is_selectable=True, is_movable=True):
         super().__init__("Rectangle", screen, x, y, offset_x=offset_x, offset_y=offset_y, anchor=anchor, depth=depth, is_selected=is_selected, is_hovered=is_hovered, is_active=is_active, is_selectable=is_selectable, is_movable=is_movable, is_previewing=is_previewing)
         self.width = width
         self.height = height
 
-    def respond(self, mouse:Mouse, keyboard:Keyboard, depth_map:np.ndarray) -> ObjectSignal:
+    @classmethod
+    def bulk_create(cls, screen, x, y, width, height, depth=0, flags=IS_ACTIVE | IS_SELECTABLE | IS_MOVABLE | IS_DELETABLE) -> List[Rectangle]:
+        # Same as calling the constructor for every row, without the per-object overhead
+        objs = cls._bulk_new(screen, len(x), x, y, depth=depth, flags=flags)
+        for obj, w, h in zip(objs, _per_object(width, len(objs)), _per_object(height, len(objs))):
+            obj.width = w
+            obj.height = h
+        return objs
+
+    def respond(self, mouse:Mouse, keyboard:Keyboard, picked:BaseInteractiveObject|None) -> ObjectSignal:
         # Setup
         triggers = []
 
         # Hovered
-        self.is_hovered = all(depth_map[mouse.x, mouse.y] == self.depth_color)
+        self.is_hovered = picked is self
         if self.is_hovered:
             triggers.append(HOVERED)
 
@@ -259,17 +578,28 @@ class Rectangle(BaseInteractiveObject):
         print(f"{self.object_type} interact")
         return SimpleObjectConnection(self.screen, self, interact, depth=0)
 
+    def get_bounds(self) -> pygame.Rect:
+        return pygame.Rect(self.x - self.width//2, self.y - self.height//2, self.width, self.height)
+
+    def contains_point(self, x, y) -> bool:
+        return self.get_bounds().collidepoint(x, y)
+
+    def get_screen_rect(self) -> pygame.Rect:
+        x, y = self.camera.world_to_screen(self.x, self.y)
+        W, H = self.width * self.camera.zoom, self.height * self.camera.zoom
+        return pygame.Rect(x - W//2, y - H//2, W, H)
+
+    def get_draw_bounds(self) -> pygame.Rect:
+        return self.get_screen_rect()
+
     def draw_depth(self, screen_depth:pygame.Surface):
-        x_left, y_top = self.x - self.width//2, self.y - self.height//2
-        W, H = self.width, self.height
-        pygame.draw.rect(screen_depth, self.depth_color, (x_left, y_top, W, H))
+        pygame.draw.rect(screen_depth, self.depth_color, self.get_screen_rect())
 
     def draw(self):
-        x_left, y_top = self.x - self.width//2, self.y - self.height//2
-        W, H = self.width, self.height
+        rect = self.get_screen_rect()
 
         if self.is_previewing:
-            pygame.draw.rect(self.screen, self.colors["preview"], (x_left, y_top, W, H), width=1)
+            pygame.draw.rect(self.screen, self.colors["preview"], rect, width=1)
             return
         elif self.is_selected:
             outline_color = self.colors["select"]
@@ -278,24 +608,49 @@ class Rectangle(BaseInteractiveObject):
         else:
             outline_color = self.colors["outline"]
 
-        pygame.draw.rect(self.screen, outline_color, (x_left, y_top, W, H))
-        pygame.draw.rect(self.screen, self.colors["base"], (x_left+2, y_top+2, W-4, H-4))
+        pygame.draw.rect(self.screen, outline_color, rect)
+        pygame.draw.rect(self.screen, self.colors["base"], rect.inflate(-4, -4))
 
 
 class Circle(BaseInteractiveObject):
+    __slots__ = ("label_id", "_label_id_finalizer")
+
+    radius = StoreField(invalidates=True) # Connection endpoints sit on the rim
+    label_id_allocator = IdAllocator() # Separate from `unique_id`, so labels stay short and human-readable
+
     def __init__(self, screen, x, y, radius, offset_x=0, offset_y=0, anchor=None, depth=0, is_previewing = False, is_selected = False, is_hovered = False, is_active = True, is_selectable=True, is_movable=True):
         super().__init__("Circle", screen, x, y, offset_x=offset_x, offset_y=offset_y, anchor=anchor, depth=depth, is_selected=is_selected, is_hovered=is_hovered, is_active=is_active, is_selectable=is_selectable, is_movable=is_movable, is_previewing=is_previewing)
         self.radius = radius
-        center_text_box = TextRectangle(screen, 0, 0, radius//2, radius//2, text=self.unique_id, anchor=self, depth=99)
+        self.label_id = self.label_id_allocator.allocate()
+        self._label_id_finalizer = _ReleaseOnce(self.label_id_allocator.release, self.label_id)
+        center_text_box = TextRectangle(screen, 0, 0, radius//2, radius//2, text=short_label(self.label_id), anchor=self, depth=99)
         self.add_bond("i_am_parent_of", center_text_box, True)
 
-    def respond(self, mouse:Mouse, keyboard:Keyboard, depth_map:np.ndarray) -> ObjectSignal:
+    @classmethod
+    def bulk_create(cls, screen, x, y, radius, depth=0, flags=IS_ACTIVE | IS_SELECTABLE | IS_MOVABLE | IS_DELETABLE, labels:bool=True) -> List[Circle]:
+        # Same as calling the constructor for every row, without the per-object overhead. Without `labels` the caller adds
+        # its own children, e.g. when loading a saved scene
+        objs = cls._bulk_new(screen, len(x), x, y, depth=depth, flags=flags)
+        cls.node_store.radius[[obj.unique_id for obj in objs]] = radius
+        label_ids = cls.label_id_allocator.allocate_many(len(objs))
+        release = cls.label_id_allocator.release
+        for obj, label_id in zip(objs, label_ids):
+            obj.label_id = label_id
+            obj._label_id_finalizer = _ReleaseOnce(release, label_id)
+        if labels:
+            sizes = [int(r)//2 for r in _per_object(radius, len(objs))]
+            texts = TextRectangle.bulk_create(screen, np.zeros(len(objs)), np.zeros(len(objs)), sizes, sizes, [short_label(i) for i in label_ids], depth=99)
+            cls.bulk_anchor(texts, objs)
+            cls.bond_index.add_pairs(objs, "i_am_parent_of", texts)
+        return objs
+
+    def respond(self, mouse:Mouse, keyboard:Keyboard, picked:BaseInteractiveObject|None) -> ObjectSignal:
         # Setup
         x, y, r = self.x, self.y, self.radius
         triggers = []
 
         # Hovered
-        self.is_hovered = all(depth_map[mouse.x, mouse.y] == self.depth_color)
+        self.is_hovered = picked is self
         if self.is_hovered:
             triggers.append(HOVERED)
 
@@ -314,26 +669,42 @@ class Circle(BaseInteractiveObject):
             return None
 
         # If node (A) is already connected to node (B) than I don't want to connect (B) with (A).
-        connection_objs = [obj for obj in interact.get_all_objects() if isinstance(obj, SimpleObjectConnection)]
-        if len(connection_objs) > 0:
-            for connection_obj in connection_objs:
-                if (connection_obj.obj1 is self) or (connection_obj.obj2 is self):
-                    return None
+        if self.connection_index.between(self, interact) is not None:
+            return None
 
         print(f"{self.object_type} interact")
         return SimpleObjectConnection(self.screen, self, interact)
 
 
+    def get_bounds(self) -> pygame.Rect:
+        x, y, r = self.x, self.y, self.radius
+        return pygame.Rect(x - r, y - r, 2*r + 1, 2*r + 1)
+
+
+    def contains_point(self, x, y) -> bool:
+        return (x - self.x)**2 + (y - self.y)**2 <= self.radius**2
+
+
+    def get_screen_circle(self) -> Tuple[float, float, float]:
+        x, y = self.camera.world_to_screen(self.x, self.y)
+        return x, y, self.radius * self.camera.zoom
+
+
+    def get_draw_bounds(self) -> pygame.Rect:
+        x, y, r = self.get_screen_circle()
+        return pygame.Rect(x - r, y - r, 2*r + 1, 2*r + 1)
+
+
     def draw_depth(self, screen_depth:pygame.Surface):
-        x, y = self.x, self.y
-        pygame.draw.circle(screen_depth, self.depth_color, (x, y), self.radius)
+        x, y, r = self.get_screen_circle()
+        pygame.draw.circle(screen_depth, self.depth_color, (x, y), r)
 
 
     def draw(self):
-        x, y = self.x, self.y
+        x, y, r = self.get_screen_circle()
 
         if self.is_previewing:
-            pygame.draw.circle(self.screen, self.colors["preview"], (x, y), self.radius, width=1)
+            pygame.draw.circle(self.screen, self.colors["preview"], (x, y), r, width=1)
             return
         elif self.is_selected:
             outline_color = self.colors["select"]
@@ -342,8 +713,13 @@ class Circle(BaseInteractiveObject):
         else:
             outline_color = self.colors["outline"]
 
-        pygame.draw.circle(self.screen, outline_color, (x, y), self.radius)
-        pygame.draw.circle(self.screen, self.colors["base"], (x, y), self.radius-2)
+        pygame.draw.circle(self.screen, outline_color, (x, y), r)
+        pygame.draw.circle(self.screen, self.colors["base"], (x, y), r-2)
+
+
+    def delete(self):
+        super().delete()
+        self._label_id_finalizer()
 
 
     def get_connection_anchor(self, interact:BaseInteractiveObject):
@@ -365,20 +741,41 @@ class Circle(BaseInteractiveObject):
 
 
 class TextRectangle(BaseInteractiveObject):
+    __slots__ = ("width", "height", "font_face", "font_size", "font", "font_color", "text")
+
     def __init__(self, screen, x, y, width, height, text:str="", font_size=25, font_color=(230, 230, 230), offset_x=0, offset_y=0, anchor=None, depth=0, is_previewing = False, is_selected = False, is_hovered = False, is_active = True, is_selectable=True, is_movable=False, is_deletable=False):
         super().__init__("TextRectangle", screen, x, y, offset_x=offset_x, offset_y=offset_y, anchor=anchor, depth=depth, is_selected=is_selected, is_hovered=is_hovered, is_active=is_active, is_selectable=is_selectable, is_movable=is_movable, is_previewing=is_previewing, is_deletable=is_deletable)
         self.width = width
         self.height = height
-        self.font = pygame.font.SysFont(None, font_size)  # None uses the default font
+        self.font_face = None # None uses the default font
+        self.font_size = font_size
+        self.font = get_font(self.font_face, font_size)
         self.font_color = font_color
         self.text = text
 
-    def respond(self, mouse:Mouse, keyboard:Keyboard, depth_map:np.ndarray) -> ObjectSignal:
+    @classmethod
+    def bulk_create(cls, screen, x, y, width, height, texts:List[str], font_size=25, font_color=(230, 230, 230), depth=0, flags=IS_ACTIVE | IS_SELECTABLE) -> List[TextRectangle]:
+        # Same as calling the constructor for every row, without the per-object overhead. Anchors are set afterwards, see `bulk_anchor`
+        objs = cls._bulk_new(screen, len(x), x, y, depth=depth, flags=flags)
+        n = len(objs)
+        font_sizes, font_colors = _per_object(font_size, n), _per_object(font_color, n, width=3)
+        fonts = {size: get_font(None, size) for size in set(font_sizes)} # One lookup per size, not per label
+        for obj, w, h, text, size, color in zip(objs, _per_object(width, n), _per_object(height, n), texts, font_sizes, font_colors):
+            obj.width = w
+            obj.height = h
+            obj.font_face = None
+            obj.font_size = size
+            obj.font = fonts[size]
+            obj.font_color = tuple(color)
+            obj.text = text
+        return objs
+
+    def respond(self, mouse:Mouse, keyboard:Keyboard, picked:BaseInteractiveObject|None) -> ObjectSignal:
         # Setup
         triggers = []
 
         # Hovered
-        self.is_hovered = all(depth_map[mouse.x, mouse.y] == self.depth_color)
+        self.is_hovered = picked is self
         if self.is_hovered:
             triggers.append(HOVERED)
 
@@ -396,17 +793,37 @@ class TextRectangle(BaseInteractiveObject):
             print("Unknown interaction")
             return None
 
+    def get_bounds(self) -> pygame.Rect:
+        return pygame.Rect(self.x - self.width//2, self.y - self.height//2, self.width, self.height)
+
+    def contains_point(self, x, y) -> bool:
+        return self.get_bounds().collidepoint(x, y)
+
+    def render_text(self) -> pygame.Surface:
+        # At the camera's zoom, font sizes are whole pixels so zooming only ever renders a label once per size
+        font_size = max(1, round(self.font_size * self.camera.zoom))
+        return label_cache.render(self.text, self.font_face, font_size, self.font_color)
+
+    def get_screen_rect(self) -> pygame.Rect:
+        x, y = self.camera.world_to_screen(self.x, self.y)
+        W, H = self.width * self.camera.zoom, self.height * self.camera.zoom
+        return pygame.Rect(x - W//2, y - H//2, W, H)
+
+    def get_draw_bounds(self) -> pygame.Rect:
+        # The label is allowed to spill out of the box
+        rect = self.get_screen_rect()
+        text_width, text_height = self.render_text().get_size()
+        text_bounds = pygame.Rect(rect.centerx - text_width//2, rect.centery - text_height//2, text_width, text_height)
+        return rect.union(text_bounds)
+
     def draw_depth(self, screen_depth:pygame.Surface):
-        x_left, y_top = self.x - self.width//2, self.y - self.height//2
-        W, H = self.width, self.height
-        pygame.draw.rect(screen_depth, self.depth_color, (x_left, y_top, W, H))
+        pygame.draw.rect(screen_depth, self.depth_color, self.get_screen_rect())
 
     def draw(self):
-        x_left, y_top = self.x - self.width//2, self.y - self.height//2
-        W, H = self.width, self.height
+        rect = self.get_screen_rect()
 
         if self.is_previewing:
-            pygame.draw.rect(self.screen, self.colors["preview"], (x_left, y_top, W, H), width=1)
+            pygame.draw.rect(self.screen, self.colors["preview"], rect, width=1)
             return
         elif self.is_selected:
             outline_color = self.colors["select"]
@@ -415,15 +832,13 @@ class TextRectangle(BaseInteractiveObject):
         else:
             outline_color = self.colors["outline"]
 
-        pygame.draw.rect(self.screen, outline_color, (x_left, y_top, W, H))
-        pygame.draw.rect(self.screen, self.colors["base"], (x_left+2, y_top+2, W-4, H-4))
+        pygame.draw.rect(self.screen, outline_color, rect)
+        pygame.draw.rect(self.screen, self.colors["base"], rect.inflate(-4, -4))
 
         # Draw centered text
-        text = self.font.render(self.text, True, self.font_color)
+        text = self.render_text()
         text_width, text_height = text.get_size()
-        top_left_x = self.x - text_width // 2
-        top_left_y = self.y - text_height // 2
-        self.screen.blit(text, (top_left_x, top_left_y))
+        self.screen.blit(text, (rect.centerx - text_width // 2, rect.centery - text_height // 2))
 
 
 ###################################################################
@@ -432,6 +847,8 @@ class TextRectangle(BaseInteractiveObject):
 
 
 class SimpleObjectConnection(BaseInteractiveObject):
+    __slots__ = ("line_thickness", "height_half", "obj1", "obj2", "node_pair", "obj1_anchor", "obj2_anchor")
+
     def __init__(self, screen, obj1:BaseInteractiveObject, obj2:BaseInteractiveObject, line_thickness:int=9, offset_x=0, offset_y=0, anchor=None, depth=0, is_previewing = False, is_selected = False, is_hovered = False, is_active = True, is_selectable=True, is_movable=False):
         super().__init__("SimpleObjectConnection", screen, x=None, y=None, offset_x=offset_x, offset_y=offset_y, anchor=anchor, depth=depth, is_selected=is_selected, is_hovered=is_hovered, is_active=is_active, is_selectable=is_selectable, is_movable=is_movable, is_previewing=is_previewing)
         assert line_thickness % 2 != 0, "Expect line thickness to be odd"
@@ -439,18 +856,45 @@ class SimpleObjectConnection(BaseInteractiveObject):
         self.height_half = (line_thickness - 1) // 2
         self.obj1 = obj1
         self.obj2 = obj2
-        self.obj1_anchor = self.obj1.get_connection_anchor(self)
-        self.obj2_anchor = self.obj2.get_connection_anchor(self)
-
-
-    def respond(self, mouse:Mouse, keyboard:Keyboard, depth_map:np.ndarray) -> ObjectSignal:
+        self.node_pair = frozenset((obj1, obj2))
+        self.obj1_anchor = None # Cached, see `get_anchors`
+        self.obj2_anchor = None
+        self.node_store.depend(self.unique_id, obj1.unique_id)
+        self.node_store.depend(self.unique_id, obj2.unique_id)
+        self.connection_index.add(self)
+
+    @classmethod
+    def bulk_create(cls, screen, objs1:List[BaseInteractiveObject], objs2:List[BaseInteractiveObject], line_thickness:int=9, depth=0,
+                    flags=IS_ACTIVE | IS_SELECTABLE | IS_DELETABLE, bond:bool=True) -> List[SimpleObjectConnection]:
+        # Same as calling the constructor for every pair, without the per-object overhead. With `bond` both nodes are
+        # bonded to their connection the way an interactive connection is, see `Engine._update_objects`
+        assert line_thickness % 2 != 0, "Expect line thickness to be odd"
+        objs = cls._bulk_new(screen, len(objs1), depth=depth, flags=flags)
+        for obj, obj1, obj2 in zip(objs, objs1, objs2):
+            obj.line_thickness = line_thickness
+            obj.height_half = (line_thickness - 1) // 2
+            obj.obj1 = obj1
+            obj.obj2 = obj2
+            obj.node_pair = frozenset((obj1, obj2))
+            obj.obj1_anchor = None
+            obj.obj2_anchor = None
+            cls.connection_index.add(obj)
+        slots = [obj.unique_id for obj in objs]
+        cls.node_store.depend_many(slots, [obj.unique_id for obj in objs1])
+        cls.node_store.depend_many(slots, [obj.unique_id for obj in objs2])
+        if bond:
+            cls.bond_index.add_pairs(objs1, "i_am_in_connection_with", objs)
+            cls.bond_index.add_pairs(objs2, "i_am_in_connection_with", objs)
+        return objs
+
+
+    def respond(self, mouse:Mouse, keyboard:Keyboard, picked:BaseInteractiveObject|None) -> ObjectSignal:
         # Setup
-        self.obj1_anchor = self.obj1.get_connection_anchor(self)
-        self.obj2_anchor = self.obj2.get_connection_anchor(self)
+        self.get_anchors()
         triggers = []
 
         # # Hovered
-        self.is_hovered = all(depth_map[mouse.x, mouse.y] == self.depth_color)
+        self.is_hovered = picked is self
         if self.is_hovered:
             triggers.append(HOVERED)
 
@@ -471,18 +915,62 @@ class SimpleObjectConnection(BaseInteractiveObject):
         print(f"{self.object_type} interact")
 
 
+    def get_anchors(self) -> Tuple[SimpleAnchor|BaseInteractiveObject, SimpleAnchor|BaseInteractiveObject]:
+        # The endpoints are only recomputed once either node moved or changed size
+        self.obj1._refresh_position()
+        self.obj2._refresh_position()
+        store, slot = self.node_store, self.unique_id
+        if (self.obj1_anchor is not None) and not (store.flags[slot] & IS_DIRTY):
+            store.reused += 1
+            return self.obj1_anchor, self.obj2_anchor
+
+        store.flags[slot] &= ~np.uint16(IS_DIRTY)
+        store.recomputed += 1
+        self.obj1_anchor = self.obj1.get_connection_anchor(self)
+        self.obj2_anchor = self.obj2.get_connection_anchor(self)
+        return self.obj1_anchor, self.obj2_anchor
+
+
+    def get_bounds(self) -> pygame.Rect:
+        p1, p2 = self.get_anchors()
+        x_left, y_top = min(p1.x, p2.x), min(p1.y, p2.y)
+        bounds = pygame.Rect(x_left, y_top, abs(p2.x - p1.x) + 1, abs(p2.y - p1.y) + 1)
+        return bounds.inflate(self.line_thickness + 2, self.line_thickness + 2)
+
+
+    def contains_point(self, x, y) -> bool:
+        p1, p2 = self.get_anchors()
+        return point_segment_distance(x, y, p1.x, p1.y, p2.x, p2.y) <= self.line_thickness / 2
+
+
+    def delete_all_bonds(self):
+        self.connection_index.remove(self)
+        super().delete_all_bonds()
+
+
+    def get_screen_line(self) -> Tuple[Tuple[float, float], Tuple[float, float], int]:
+        # Both ends and the thickness on screen
+        p1, p2 = self.get_anchors()
+        camera = self.camera
+        return camera.world_to_screen(p1.x, p1.y), camera.world_to_screen(p2.x, p2.y), max(1, round(self.line_thickness * camera.zoom))
+
+
+    def get_draw_bounds(self) -> pygame.Rect:
+        (x1, y1), (x2, y2), thickness = self.get_screen_line()
+        bounds = pygame.Rect(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+        return bounds.inflate(thickness + 2, thickness + 2)
+
+
     def draw_depth(self, screen_depth:pygame.Surface):
-        p1 = self.obj1_anchor
-        p2 = self.obj2_anchor
-        pygame.draw.line(screen_depth, self.depth_color, (p1.x, p1.y), (p2.x, p2.y), width=self.line_thickness)
+        p1, p2, thickness = self.get_screen_line()
+        pygame.draw.line(screen_depth, self.depth_color, p1, p2, width=thickness)
 
 
     def draw(self):
-        p1 = self.obj1_anchor
-        p2 = self.obj2_anchor
+        p1, p2, thickness = self.get_screen_line()
 
         if self.is_previewing:
-            pygame.draw.line(self.screen, self.colors["preview"], (p1.x, p1.y), (p2.x, p2.y), width=self.line_thickness + 2)
+            pygame.draw.line(self.screen, self.colors["preview"], p1, p2, width=thickness + 2)
             return
         elif self.is_selected:
             outline_color = self.colors["select"]
@@ -491,8 +979,8 @@ class SimpleObjectConnection(BaseInteractiveObject):
         else:
             outline_color = self.colors["outline"]
 
-        pygame.draw.line(self.screen, outline_color, (p1.x, p1.y), (p2.x, p2.y), width=self.line_thickness)
-        pygame.draw.line(self.screen, self.colors["base"], (p1.x, p1.y), (p2.x, p2.y), width=max(1, self.line_thickness-2))
+        pygame.draw.line(self.screen, outline_color, p1, p2, width=thickness)
+        pygame.draw.line(self.screen, self.colors["base"], p1, p2, width=max(1, thickness-2))
 
 
 